@@ -20,10 +20,23 @@ CREATE TABLE prompt_config (
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     topic TEXT NOT NULL,
     scope TEXT,
-    covered_topics TEXT[] DEFAULT '{}',
-    wpm INT NOT NULL DEFAULT 125
+    wpm INT NOT NULL DEFAULT 125,
+    encoder_profile TEXT NOT NULL DEFAULT 'balanced' -- Named encoder profile of the final render (see stitch_video.ENCODER_PROFILES)
 );
 
+-- Titles already covered by a prompt config (the prompt only carries the most recent ones)
+CREATE TABLE covered_topics (
+    id SERIAL PRIMARY KEY,
+    prompt_config_id INT NOT NULL REFERENCES prompt_config(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    normalized_title TEXT NOT NULL, -- Lowercase, no accents or punctuation (see prompt_crud.normalize_topic)
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE(prompt_config_id, normalized_title) -- Makes adding a topic an atomic upsert
+);
+
+-- Speeds up fetching the most recent topics of a prompt config
+CREATE INDEX covered_topics_recent_idx ON covered_topics (prompt_config_id, created_at DESC);
+
 -- Social tokens table to hold the platform to automate/schedule posting
 CREATE TABLE social_tokens (
     id SERIAL PRIMARY KEY,
@@ -47,4 +60,42 @@ CREATE TABLE user_schedule (
     schedule_hour INT NOT NULL, 
     UNIQUE(user_id, schedule_day, schedule_hour)  -- Prevents duplicates
     -- schedule_time TIME NOT NULL 
-);
\ No newline at end of file
+);
+
+-- Videos rendered ahead of their scheduled slot (main.py --render-ahead), waiting to be posted at the slot
+CREATE TABLE ready_videos (
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    slot_at TIMESTAMP NOT NULL, -- Scheduled day and hour the video is meant for
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'ready', -- 'ready' or 'posted'
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    posted_at TIMESTAMP,
+    UNIQUE(user_id, slot_at) -- One staged video per user and slot
+);
+
+-- Generation runs dequeued by the workers (main.py --worker), one job per user and slot
+CREATE TABLE video_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    slot_at TIMESTAMP NOT NULL, -- Scheduled day and hour the video is meant for
+    status VARCHAR NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'done' or 'failed'
+    -- Per stage status, duration and artifacts, e.g {"audio": {"status": "done", "seconds": 4.2, "artifact": ".../narration.mp3"}}
+    stages JSONB NOT NULL DEFAULT '{}',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    worker_id TEXT, -- host:pid of the worker that holds (or last held) the job
+    last_error TEXT,
+    video_path TEXT,
+    run_after TIMESTAMP NOT NULL DEFAULT NOW(), -- Retries are delayed with a backoff
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP, -- Refreshed while running so crashed workers can be detected
+    finished_at TIMESTAMP,
+    UNIQUE(user_id, slot_at) -- Several cron nodes can enqueue the same slot safely
+);
+
+-- Speeds up the dequeue query
+CREATE INDEX video_jobs_dequeue_idx ON video_jobs (status, run_after);
@@ -1,3 +1,4 @@
+import os
 import argparse
 from dotenv import load_dotenv
 
@@ -12,12 +13,87 @@ def main():
         action="store_true",
         help="Run scheduled cron jobs (check if any post is scheduled at this hour)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Max number of users processed concurrently by --cron and --render-ahead (defaults to CRON_MAX_WORKERS or 4)"
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="With --cron, only enqueue the users due at this hour as jobs for the workers"
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Run a job worker that dequeues and runs the enqueued generation jobs"
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="With --worker, exit once the queue is empty instead of polling"
+    )
+    parser.add_argument(
+        "--render-ahead",
+        type=int,
+        metavar="HOURS",
+        default=None,
+        help="Pre-build the videos of the slots scheduled in the next HOURS hours so the slot only uploads them"
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        default=None,
+        help="Resume a failed run (e.g, user_3_20250101_18), reusing every stage that already completed"
+    )
+    parser.add_argument(
+        "--encoder-profile",
+        default=None,
+        help="Encoder profile for every video of this run (fast-draft, balanced, upload-optimized), overrides the user's profile"
+    )
+    parser.add_argument(
+        "--image-server",
+        action="store_true",
+        help="Run the resident local image model server (keeps Stable Diffusion loaded between runs)"
+    )
+    parser.add_argument(
+        "--benchmark-images",
+        nargs="+",
+        metavar="PROFILE",
+        default=None,
+        help="Measure the seconds per image of local image profiles (e.g, cpu-quality cpu-fast cpu-openvino)"
+    )
     args = parser.parse_args()
 
+    # Run level override read by stitch_video
+    if args.encoder_profile:
+        os.environ["ENCODER_PROFILE"] = args.encoder_profile
+
     # Checks the argument to see if it should run the cli or just the scheduled check
-    if args.cron:
+    if args.image_server:
+        from src.video_generator.image_server import run_image_server
+        run_image_server()
+    elif args.benchmark_images:
+        from src.video_generator.image_model import benchmark_local_profiles
+        benchmark_local_profiles(args.benchmark_images)
+    elif args.resume:
+        from src.utils.checkpoint import load_manifest
+        from src.video_generator.generate_video import generate_video
+        manifest = load_manifest(args.resume)
+        if manifest.get("user_id") is None:
+            print(f"[ERROR] No run found with id {args.resume}")
+        else:
+            generate_video(manifest["user_id"], run_id=args.resume)
+    elif args.worker:
+        from src.scheduler.job_worker import run_worker
+        run_worker(once=args.once)
+    elif args.render_ahead is not None:
+        from src.scheduler.scheduled_task import render_ahead
+        render_ahead(args.render_ahead, max_workers=args.workers)
+    elif args.cron:
         from src.scheduler.scheduled_task import post_scheduled_content
-        post_scheduled_content()
+        post_scheduled_content(max_workers=args.workers, enqueue=args.enqueue)
     else:
         from src.cli import cli_main
         cli_main()
@@ -9,6 +9,7 @@ from src.crud import (
 from src.poster.tiktok_poster import login_and_save_session
 from src.video_generator import generate_video
 from src.scheduler import scheduler_manager
+from src.video_generator.stitch_video import ENCODER_PROFILES
 
 # Main menu and entry point for the cli logic
 def cli_main():
@@ -100,8 +101,11 @@ def user_menu_flow(user:dict) -> None:
         elif choice == "Update social tokens":
             tokens_management_flow(user['id'])
         elif choice == "Generate a video":
-            path = generate_video.generate_video(user['id'])
+            post_results = {}
+            path = generate_video.generate_video(user['id'], post_results=post_results)
             print(f"✅ Video generated at {path}")
+            for platform, result in post_results.items():
+                print(f"  {platform}: {result['status']}" + (f" ({result['error']})" if result.get("error") else ""))
         elif choice == "Delete user":
             if inquirer.confirm(message=f"Are you sure you want to delete the user {user['username']}?").execute():
                 user_crud.delete_user(user['id'])
@@ -117,12 +121,18 @@ def update_prompt_config_flow(user_id:int) -> None:
     print(f"current topic: {config['topic']}")
     print(f"current scope: {config['scope']}")
     print(f"current wpm:   {config['wpm']}")
+    print(f"current encoder profile: {config.get('encoder_profile')}")
     field = inquirer.select(
         message="Which field to update?",
-        choices=["topic", "scope", "wpm", "cancel"]
+        choices=["topic", "scope", "wpm", "encoder_profile", "cancel"]
     ).execute()
     if field == "cancel":
         return
+    elif field == "encoder_profile":
+        new = inquirer.select(
+            message="New encoder profile:",
+            choices=list(ENCODER_PROFILES.keys())
+        ).execute()
     elif field == "wpm":
         new = int(inquirer.text(
             message=f"New {field}:",
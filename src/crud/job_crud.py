@@ -0,0 +1,124 @@
+from src.db import get_conn
+from psycopg2.extras import RealDictCursor, Json
+from typing import Optional
+import datetime
+
+# Function to enqueue a generation job for a user's slot
+def enqueue_job(user_id: int, slot_at: datetime.datetime, max_attempts: int = 3) -> Optional[int]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO video_jobs (user_id, slot_at, max_attempts)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, slot_at) DO NOTHING
+            RETURNING id;
+            """,
+            (user_id, slot_at, max_attempts)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        # None if the slot was already enqueued (e.g, by another node)
+        return row[0] if row else None
+
+# Function to claim the next runnable job, jobs locked by other workers are skipped instead of waited on
+def dequeue_job(worker_id: str, stale_minutes: int) -> Optional[dict]:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # A crashed worker never records its failure, so stale jobs that used up their attempts
+        # (e.g, a job that always gets its worker killed) are failed here instead of being run forever
+        cur.execute(
+            """
+            UPDATE video_jobs SET
+                status = 'failed',
+                finished_at = NOW(),
+                last_error = COALESCE(last_error, 'Worker stopped sending heartbeats on the last attempt')
+            WHERE status = 'running'
+                AND heartbeat_at < NOW() - make_interval(mins => %s)
+                AND attempts >= max_attempts
+            """,
+            (stale_minutes,)
+        )
+        cur.execute(
+            """
+            UPDATE video_jobs SET
+                status = 'running',
+                worker_id = %s,
+                attempts = attempts + 1,
+                started_at = NOW(),
+                heartbeat_at = NOW(),
+                last_error = NULL
+            WHERE id = (
+                SELECT id FROM video_jobs
+                WHERE (status = 'queued' AND run_after <= NOW())
+                    -- Running jobs whose worker stopped sending heartbeats (crashed) are picked up again
+                    OR (status = 'running' AND heartbeat_at < NOW() - make_interval(mins => %s) AND attempts < max_attempts)
+                ORDER BY slot_at, created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING *;
+            """,
+            (worker_id, stale_minutes)
+        )
+        job = cur.fetchone()
+        conn.commit()
+        return job
+
+# The updates of a running job only apply while the worker still owns it: once a stale job is claimed again
+# by another worker, the updates of the previous owner match no row (False / None is returned)
+
+# Function to refresh the heartbeat of a running job
+def heartbeat_job(job_id: int, worker_id: str) -> bool:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE video_jobs SET heartbeat_at = NOW() WHERE id = %s AND worker_id = %s AND status = 'running'",
+            (job_id, worker_id)
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+# Function to record the status, duration and artifact of a single stage of a job
+def update_job_stage(job_id: int, worker_id: str, stage: str, stage_data: dict) -> bool:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE video_jobs SET
+                stages = stages || jsonb_build_object(%s::text, %s::jsonb),
+                heartbeat_at = NOW()
+            WHERE id = %s AND worker_id = %s AND status = 'running'
+            """,
+            (stage, Json(stage_data), job_id, worker_id)
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+# Function to mark a job as successfully finished
+def complete_job(job_id: int, worker_id: str, video_path: str) -> bool:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE video_jobs SET status = 'done', video_path = %s, finished_at = NOW()
+            WHERE id = %s AND worker_id = %s AND status = 'running'
+            """,
+            (video_path, job_id, worker_id)
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+# Function to record a failed attempt, the job is queued again after a delay until it runs out of attempts
+def fail_job(job_id: int, worker_id: str, error: str, retry_delay_seconds: int) -> Optional[str]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE video_jobs SET
+                status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                last_error = %s,
+                run_after = NOW() + make_interval(secs => %s),
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END
+            WHERE id = %s AND worker_id = %s AND status = 'running'
+            RETURNING status;
+            """,
+            (error, retry_delay_seconds, job_id, worker_id)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
@@ -1,11 +1,13 @@
-from src.db import conn
+import re
+import unicodedata
+from src.db import get_conn
 from psycopg2.extras import RealDictCursor
 from typing import Optional, Literal
 
 # Function to cerate a new prompt config
 def create_prompt_config(user_id:int, topic:str, scope:str, wpm:int) -> int:
     # Creates a new cursor and uses context manager to close it once the block finishes
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         # Executes the custom sql command
         cur.execute(
             "INSERT INTO prompt_config (user_id, topic, scope,  wpm) VALUES (%s, %s,%s, %s) RETURNING id;",
@@ -20,44 +22,66 @@ def create_prompt_config(user_id:int, topic:str, scope:str, wpm:int) -> int:
 
 # Function to retrieve the prompt config by it's user id
 def get_prompt_config(user_id: int) -> Optional[dict]:
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("SELECT * FROM prompt_config WHERE user_id = %s;", (user_id,))
         # Returns a directory or None if not found 
         return cur.fetchone()
 
-# Function to update a user mutable field (topic, scope, wpm) in prompt_config
+# Function to update a user mutable field (topic, scope, wpm, encoder_profile) in prompt_config
 def update_prompt_config_field(
     user_id:int,
-    field:Literal["topic", "scope", "wpm"], # Literal to restrict the field's param
+    field:Literal["topic", "scope", "wpm", "encoder_profile"], # Literal to restrict the field's param
     new_value: str | int
 ) -> None:
-    if field not in ["topic", "scope", "wpm"]:
-        raise ValueError("Invalid field. Only 'topic', 'scope', or 'wpm' are allowed")
+    if field not in ["topic", "scope", "wpm", "encoder_profile"]:
+        raise ValueError("Invalid field. Only 'topic', 'scope', 'wpm' or 'encoder_profile' are allowed")
     
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             f"UPDATE prompt_config SET {field} = %s WHERE user_id = %s", 
             (new_value, user_id)
         )
         conn.commit()
 
-# Function to append a topic to covered_topics if not already present
-def append_covered_topic_if_missing(prompt_config_id: int, new_title: str) -> None:
-    with conn.cursor() as cur:
+# Helper function to normalize a topic title so variants of the same title share a key (case, accents, punctuation).
+# Works on any script: only the accents of Latin letters are dropped, other letters are kept as they are
+def normalize_topic(title: str) -> str:
+    chars = []
+    for ch in unicodedata.normalize("NFKD", title.casefold()):
+        if unicodedata.combining(ch) and chars and chars[-1].isascii():
+            continue
+        chars.append(ch)
+    folded = unicodedata.normalize("NFC", "".join(chars))
+    # Falls back to the casefolded title so a title made only of symbols still gets its own key
+    return re.sub(r"[\W_]+", " ", folded, flags=re.UNICODE).strip() or title.casefold().strip()
+
+# Function to add a covered topic, returns False if it was already covered (single atomic upsert)
+def add_covered_topic(prompt_config_id: int, title: str) -> bool:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO covered_topics (prompt_config_id, title, normalized_title)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (prompt_config_id, normalized_title) DO NOTHING
+            RETURNING id;
+            """,
+            (prompt_config_id, title, normalize_topic(title))
+        )
+        added = cur.fetchone() is not None
+        conn.commit()
+        return added
+
+# Function to get the most recent covered topics of a prompt config (newest first)
+def get_recent_covered_topics(prompt_config_id: int, limit: int) -> list[str]:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            "SELECT covered_topics FROM prompt_config WHERE id = %s;",
-            (prompt_config_id,)
+            "SELECT title FROM covered_topics WHERE prompt_config_id = %s ORDER BY created_at DESC, id DESC LIMIT %s;",
+            (prompt_config_id, limit)
         )
-        covered_topics = cur.fetchone()
-        
-        if covered_topics is None:
-            raise ValueError(f"No prompt config found with id {prompt_config_id}")
-        
-        covered_topics = covered_topics[0]
+        return [row[0] for row in cur.fetchall()]
 
-        if new_title not in covered_topics:
-            cur.execute(
-                "UPDATE prompt_config SET covered_topics = array_append(covered_topics, %s) WHERE id = %s;",
-                (new_title, prompt_config_id)
-            )
-            conn.commit()
\ No newline at end of file
+# Function to get the normalized titles of every covered topic of a prompt config (for the local duplicate check)
+def get_covered_topic_keys(prompt_config_id: int) -> list[str]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT normalized_title FROM covered_topics WHERE prompt_config_id = %s;", (prompt_config_id,))
+        return [row[0] for row in cur.fetchall()]
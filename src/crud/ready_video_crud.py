@@ -0,0 +1,55 @@
+from src.db import get_conn
+from psycopg2.extras import RealDictCursor
+from typing import Optional
+import datetime
+
+# Function to stage a rendered video for a user's upcoming slot
+def create_ready_video(
+    user_id: int,
+    slot_at: datetime.datetime,
+    title: str,
+    description: str,
+    video_path: str
+) -> Optional[int]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO ready_videos (user_id, slot_at, title, description, video_path)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, slot_at) DO NOTHING
+            RETURNING id;
+            """,
+            (user_id, slot_at, title, description, video_path)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        # None if the slot already had a staged video
+        return row[0] if row else None
+
+# Function to fetch the staged video of a user for a slot that has not been posted yet
+def get_ready_video(user_id: int, slot_at: datetime.datetime) -> Optional[dict]:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT * FROM ready_videos WHERE user_id = %s AND slot_at = %s AND status = 'ready';",
+            (user_id, slot_at)
+        )
+        return cur.fetchone()
+
+# Function to fetch the (user_id, slot_at) pairs that already have a staged video within a time window
+def get_staged_slots(start: datetime.datetime, end: datetime.datetime) -> set[tuple]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT user_id, slot_at FROM ready_videos WHERE slot_at >= %s AND slot_at <= %s;",
+            (start, end)
+        )
+        return {(row[0], row[1]) for row in cur.fetchall()}
+
+# Function to mark a staged video as posted
+def mark_ready_video_posted(ready_video_id: int) -> bool:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE ready_videos SET status = 'posted', posted_at = NOW() WHERE id = %s",
+            (ready_video_id,)
+        )
+        conn.commit()
+        return cur.rowcount > 0
@@ -1,4 +1,4 @@
-from src.db import conn
+from src.db import get_conn
 import psycopg2.errors
 import datetime
 from typing import Optional
@@ -6,7 +6,7 @@ from typing import Optional
 # Function to create a schedule entry
 def create_schedule(user_id:int, schedule_day:str, schedule_hour:int) -> int:
     try:
-        with conn.cursor() as cur:
+        with get_conn() as conn, conn.cursor() as cur:
             cur.execute(
                 """
                 INSERT INTO user_schedule (user_id, schedule_day, schedule_hour) 
@@ -19,20 +19,20 @@ def create_schedule(user_id:int, schedule_day:str, schedule_hour:int) -> int:
             conn.commit()
             return schedule_id
     except psycopg2.errors.UniqueViolation:
-        conn.rollback()
+        # get_conn already rolled the failed insert back
         print(f"User already has a schedule for {schedule_day} at {schedule_hour:02d}:00")
         return None
 
 # Function to remove a specific schedule
 def remove_schedule(user_id: int, schedule_day: str, schedule_hour: int) -> bool:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute("DELETE FROM user_schedule WHERE user_id = %s AND schedule_day = %s AND schedule_hour = %s",(user_id, schedule_day, schedule_hour))
         conn.commit()
         return cur.rowcount > 0
 
 # Function to get all schedules for a specific user
 def get_user_schedule(user_id:int) -> list[tuple]:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
         """
         SELECT schedule_day, schedule_hour FROM
@@ -55,6 +55,12 @@ def get_user_schedule(user_id:int) -> list[tuple]:
 # Function to fetch all users that have post schedules at the current time
 def get_users_to_post_at(schedule_day: str, schedule_hour: int) -> list[int]:
 
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT user_id FROM user_schedule WHERE schedule_day = %s AND schedule_hour = %s", (schedule_day, schedule_hour))
-        return [row[0] for row in cur.fetchall()]
\ No newline at end of file
+        return [row[0] for row in cur.fetchall()]
+
+# Function to fetch every schedule entry (used to find the upcoming slots)
+def get_all_schedules() -> list[tuple]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT user_id, schedule_day, schedule_hour FROM user_schedule")
+        return cur.fetchall()
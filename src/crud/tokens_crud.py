@@ -1,4 +1,4 @@
-from src.db import conn
+from src.db import get_conn
 from psycopg2.extras import RealDictCursor
 from typing import Optional
 from src.utils.encryption import encrypt, decrypt
@@ -12,7 +12,7 @@ def create_token(
     client_secret: Optional[str] = None,
     cookies: Optional[str] = None
 ) -> int:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO social_tokens (
@@ -35,7 +35,7 @@ def create_token(
 
 # Function to fetch a token for an user and platform
 def get_token_by_user_and_platform(user_id: int, platform:str) -> Optional[dict]:
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("SELECT * FROM social_tokens WHERE user_id = %s AND platform = %s", (user_id, platform))
         token =  cur.fetchone()
 
@@ -76,14 +76,14 @@ def update_token(
     values = list(update_fields.values()) + [user_id, platform]
 
     query = f"UPDATE social_tokens SET {set_clause} WHERE user_id = %s AND platform = %s;"
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(query, values)
         conn.commit()
         return cur.rowcount > 0
 
 # Function to delete a social media token
 def delete_token(user_id: int, platform: str) -> bool:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             "DELETE FROM social_tokens WHERE user_id = %s AND platform = %s;",
             (user_id, platform)
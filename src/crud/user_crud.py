@@ -1,11 +1,11 @@
-from src.db import conn
+from src.db import get_conn
 from psycopg2.extras import RealDictCursor
 from typing import Optional
 
 # Function to cerate a new user
 def create_user(username:str, voice_id: str) -> int:
     # Creates a new cursor and uses context manager to close it once the block finishes
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         # Executes the custom sql command
         cur.execute(
             "INSERT INTO users (username, voice_id) VALUES (%s, %s) RETURNING id;",
@@ -20,20 +20,20 @@ def create_user(username:str, voice_id: str) -> int:
 
 # Function to retrieve all users
 def get_all_users() -> list[dict]:
-    with conn.cursor(cursor_factory=RealDictCursor)as cur:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor)as cur:
         cur.execute("SELECT * FROM users")
         return cur.fetchall()
 
 # Function to retrieve an user by it's id
 def get_user(user_id: int) -> Optional[dict]:
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("SELECT * FROM users WHERE id = %s;", (user_id,))
         # Returns a dictionary or None if not found 
         return cur.fetchone()
 
 # Function to update the user's voice id
 def update_voice_id(user_id: int, new_voice_id: str) -> bool:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             "UPDATE users SET voice_id = %s WHERE id = %s",
             (new_voice_id, user_id)
@@ -43,7 +43,7 @@ def update_voice_id(user_id: int, new_voice_id: str) -> bool:
 
 # Function to delete an user
 def delete_user(user_id: int) -> bool:
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
         conn.commit()
         return cur.rowcount > 0
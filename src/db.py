@@ -1,11 +1,36 @@
 import os
-import psycopg2
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
 
-# PSQL connection set up
-conn = psycopg2.connect(
+# Max number of open connections, the crud calls beyond it wait for a free one (default 10)
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_CONNECTIONS", 10))
+
+# PSQL connection pool set up (each crud call borrows its own connection, so concurrent users
+# and the job heartbeat thread never share a transaction)
+pool = ThreadedConnectionPool(
+    1,
+    DB_POOL_MAX_CONNECTIONS,
     dbname=os.environ["DB_NAME"],
     user=os.environ["DB_USER"],
     password=os.environ["DB_PASSWORD"],
     host=os.environ.get("DB_HOST", "localhost"),
     port=os.environ.get("DB_PORT", 5432)
-)
\ No newline at end of file
+)
+# The pool raises when it is exhausted instead of waiting, so borrowing is bounded here
+pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+
+# Context manager to borrow a connection for a single crud call.
+# Commits when the block finishes and rolls back on error, so a failed statement never leaks into another call
+@contextmanager
+def get_conn():
+    with pool_slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
@@ -1,9 +1,80 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from src.poster.tiktok_poster import post_to_tiktok
 from src.poster.youtube_poster import post_to_youtube
 
+# Max seconds to wait for each platform, all of them post at the same time so the slowest one sets the posting time
+POST_TIMEOUTS = {
+    "youtube": int(os.environ.get("YOUTUBE_POST_TIMEOUT", 900)),
+    # Drives a browser, the upload and checks take minutes
+    "tiktok": int(os.environ.get("TIKTOK_POST_TIMEOUT", 900)),
+}
 
-# Post video to social media platforms
-def post_video(user_id: int, final_video_path: str, description: str, title: str):
-    post_to_youtube(user_id, final_video_path, description, title)
-    post_to_tiktok(user_id, final_video_path, description)
+# Poster of each platform as fn(user_id, final_video_path, description, title).
+# A poster returns the remote id (or True when the platform doesn't give one), None when the user has no
+# credentials for it, and False or an exception when the post failed
+PLATFORM_POSTERS = {
+    "youtube": post_to_youtube,
+    "tiktok": lambda user_id, final_video_path, description, title: post_to_tiktok(user_id, final_video_path, description),
     # Consider adding the instagram logic
+}
+
+
+# Helper function to run a single platform poster and turn its outcome into a result
+def run_poster(platform: str, user_id: int, final_video_path: str, description: str, title: str) -> dict:
+    start = time.perf_counter()
+    try:
+        outcome = PLATFORM_POSTERS[platform](user_id, final_video_path, description, title)
+    except Exception as e:
+        return {"status": "failed", "remote_id": None, "seconds": round(time.perf_counter() - start, 2), "error": str(e)}
+
+    result = {"status": "posted", "remote_id": None, "seconds": round(time.perf_counter() - start, 2), "error": None}
+    if outcome is None:
+        result["status"] = "skipped"
+    elif outcome is False:
+        result.update(status="failed", error="Post not confirmed, see the logs")
+    elif outcome is not True:
+        result["remote_id"] = outcome
+    return result
+
+# Post video to social media platforms concurrently. Returns a result per platform:
+# {"status": "posted" | "skipped" | "failed" | "timeout", "remote_id", "seconds", "error"}
+# A timed out poster keeps running, on_late_result(platform, result), if given, is called with its real result once it ends
+def post_video(
+    user_id: int,
+    final_video_path: str,
+    description: str,
+    title: str,
+    platforms: list[str] | None = None,
+    on_late_result=None
+) -> dict[str, dict]:
+    platforms = platforms or list(PLATFORM_POSTERS)
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(platforms), thread_name_prefix="autoshorts-post")
+    futures = {
+        platform: executor.submit(run_poster, platform, user_id, final_video_path, description, title)
+        for platform in platforms
+    }
+
+    results = {}
+    for platform, future in futures.items():
+        # Every platform started at the same time, so its timeout counts from the common start
+        remaining = POST_TIMEOUTS[platform] - (time.perf_counter() - start)
+        try:
+            results[platform] = future.result(timeout=max(0, remaining))
+        except TimeoutError:
+            results[platform] = {
+                "status": "timeout",
+                "remote_id": None,
+                "seconds": round(time.perf_counter() - start, 2),
+                "error": f"No result after {POST_TIMEOUTS[platform]}s",
+            }
+            if on_late_result:
+                future.add_done_callback(lambda done, platform=platform: on_late_result(platform, done.result()))
+    # A timed out poster can't be interrupted, it is left to finish in the background
+    executor.shutdown(wait=False)
+
+    for platform, result in results.items():
+        print(f"[INFO] {platform}: {result['status']} in {result['seconds']}s" + (f" ({result['error']})" if result["error"] else ""))
+    return results
@@ -1,16 +1,21 @@
 import os
 import json
 import time
+import atexit
 import random
+import shutil
 import tempfile
 import platform
+import threading
 from pathlib import Path
+from contextlib import contextmanager
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 
 import undetected_chromedriver as uc
 from src.crud.tokens_crud import get_token_by_user_and_platform, update_token
@@ -25,6 +30,77 @@ CAPTION_CSS = "[contenteditable='true']"
 POST_BTN_CSS = "[data-e2e='post_video_button']"
 MODAL_CONTAINER_CSS = ".TUXModal"
 
+# Warm browser pool: max number of Chrome instances alive at the same time (posts beyond it wait for a free one)
+TIKTOK_POOL_SIZE = int(os.environ.get("TIKTOK_POOL_SIZE", 2))
+# Posts served by a browser before it is replaced by a fresh one
+TIKTOK_DRIVER_MAX_USES = int(os.environ.get("TIKTOK_DRIVER_MAX_USES", 10))
+# Origins whose storage is wiped between users
+TIKTOK_ORIGINS = ["https://www.tiktok.com", "https://tiktok.com"]
+
+# Humanizing pauses between UI actions: off (none), light (a third of the human-like range) or normal (full range)
+TIKTOK_HUMANIZE = os.environ.get("TIKTOK_HUMANIZE", "light").lower()
+HUMANIZE_SCALES = {"off": 0.0, "light": 0.35, "normal": 1.0}
+# Max seconds to wait for TikTok to finish processing the uploaded file (post button enabled)
+TIKTOK_UPLOAD_TIMEOUT = int(os.environ.get("TIKTOK_UPLOAD_TIMEOUT", 300))
+# Seconds without new network requests after which a page counts as idle
+TIKTOK_NETWORK_IDLE_SECONDS = float(os.environ.get("TIKTOK_NETWORK_IDLE_SECONDS", 0.5))
+
+# ---------- Wait & pacing helpers ----------
+# Function to pause like a human between UI actions, the [low, high] range is scaled by the TIKTOK_HUMANIZE policy
+def humanize_pause(low: float, high: float) -> None:
+    scale = HUMANIZE_SCALES.get(TIKTOK_HUMANIZE, 1.0)
+    if scale > 0:
+        time.sleep(random.uniform(low, high) * scale)
+
+# Function to wait until the current document finished loading
+def wait_for_page_ready(driver: uc.Chrome, timeout: float = 20) -> None:
+    WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+        lambda d: d.execute_script("return document.readyState") == "complete"
+    )
+
+# Function to wait until the page stops issuing network requests (pages that keep polling are given up on quietly)
+def wait_for_network_idle(driver: uc.Chrome, timeout: float = 15) -> None:
+    state = {"count": -1, "since": time.monotonic()}
+
+    def is_idle(d) -> bool:
+        count = d.execute_script(
+            "performance.setResourceTimingBufferSize(5000);"
+            "return performance.getEntriesByType('resource').length;"
+        )
+        now = time.monotonic()
+        if count != state["count"]:
+            state["count"], state["since"] = count, now
+            return False
+        return now - state["since"] >= TIKTOK_NETWORK_IDLE_SECONDS
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(is_idle)
+    except TimeoutException:
+        print("[WARN] Page did not go network idle, continuing.")
+
+# Function to wait until an element is hidden or removed (e.g, a closed modal or dropdown)
+def wait_for_invisible(driver: uc.Chrome, element, timeout: float = 5) -> None:
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(EC.invisibility_of_element(element))
+    except TimeoutException:
+        pass
+
+# Helper to time a step of a post, the durations are added up per step name
+@contextmanager
+def timed_step(timings: dict, name: str):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.monotonic() - started
+
+# Helper function to print the per step timing breakdown of a post
+def print_timings(timings: dict) -> None:
+    if not timings:
+        return
+    steps = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items())
+    print(f"[INFO] TikTok step timings: {steps} (total {sum(timings.values()):.1f}s)")
+
 # ---------- Driver & stealth helpers ----------
 # Creates an undetected-chromedriver Chrome instance tuned for TikTok.
 def create_driver(headless: bool = False) -> uc.Chrome:
@@ -67,6 +143,10 @@ def create_driver(headless: bool = False) -> uc.Chrome:
 
     # Creates an undetected chromedriver Chrome instance. (use_subprocess=True runs the browser in a separate subproces)
     driver = uc.Chrome(options=options, use_subprocess=True)
+    # Kept on the driver so the profile can be deleted once the browser is closed
+    driver.profile_dir = temp_profile
+    driver.headless_mode = headless
+    driver.uses = 0
 
     # Post-start small Chrome DevTools Protocol stealth patches (run on every page)
     try:
@@ -97,9 +177,19 @@ def create_driver(headless: bool = False) -> uc.Chrome:
         print(f"[WARN] CDP stealth patch failed: {e}")
 
     # small startup delay
-    time.sleep(random.uniform(1.0, 2.0))
+    humanize_pause(1.0, 2.0)
     return driver
 
+# Function to quit a driver and delete its temporary profile
+def close_driver(driver: uc.Chrome) -> None:
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    profile_dir = getattr(driver, "profile_dir", None)
+    if profile_dir:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
 # Function to prevent onelink/intent deeplink redirects that kill the upload flow
 # using CDP blocked URLs and JS overrides for window.open/location.assign
 def block_onelink_and_intents(driver: uc.Chrome):
@@ -147,6 +237,78 @@ def block_onelink_and_intents(driver: uc.Chrome):
     except Exception:
         pass
 
+# ---------- Driver pool ----------
+# Warm drivers waiting for the next post
+idle_drivers: list[uc.Chrome] = []
+idle_drivers_lock = threading.Lock()
+# Bounds the number of browsers alive (idle or in use)
+driver_slots = threading.BoundedSemaphore(TIKTOK_POOL_SIZE)
+
+# Function to wipe everything a user left in a browser (cookies, storage, cache, extra tabs) so the next user starts clean
+def reset_driver(driver: uc.Chrome) -> None:
+    for handle in driver.window_handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(driver.window_handles[0])
+    driver.get("about:blank")
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    for origin in TIKTOK_ORIGINS:
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+# Function to get a warm driver from the pool, or start a new one if none is idle
+def acquire_driver(headless: bool = True) -> uc.Chrome:
+    driver_slots.acquire()
+    try:
+        stale = []
+        driver = None
+        with idle_drivers_lock:
+            while idle_drivers:
+                candidate = idle_drivers.pop()
+                if candidate.headless_mode == headless:
+                    driver = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            close_driver(candidate)
+        if driver:
+            return driver
+
+        # Cold start (only once per pool slot until the driver is recycled)
+        driver = create_driver(headless=headless)
+        # Prevent deeplink redirects that can break the upload flow
+        block_onelink_and_intents(driver)
+        return driver
+    except Exception:
+        driver_slots.release()
+        raise
+
+# Function to give a driver back to the pool. Drivers that failed or served TIKTOK_DRIVER_MAX_USES posts are closed
+def release_driver(driver: uc.Chrome, reusable: bool = True) -> None:
+    try:
+        driver.uses += 1
+        if reusable and driver.uses < TIKTOK_DRIVER_MAX_USES:
+            try:
+                reset_driver(driver)
+                with idle_drivers_lock:
+                    idle_drivers.append(driver)
+                return
+            except Exception as e:
+                print(f"[WARN] Could not reset the browser, closing it: {e}")
+        close_driver(driver)
+    finally:
+        driver_slots.release()
+
+# Function to close every idle driver (runs when the process exits)
+def close_idle_drivers() -> None:
+    with idle_drivers_lock:
+        drivers = list(idle_drivers)
+        idle_drivers.clear()
+    for driver in drivers:
+        close_driver(driver)
+
+atexit.register(close_idle_drivers)
+
 # ---------- Cookie helpers ----------
 # Function to login and save the cookies to DB
 def login_and_save_session(user_id: int) -> None:
@@ -164,10 +326,7 @@ def login_and_save_session(user_id: int) -> None:
     finally:
         # Ensure the browser closes cleanly
         if driver:
-            try:
-                driver.quit()
-            except Exception:
-                pass
+            close_driver(driver)
 
 # Function to load a saved TikTok session into the active driver
 def load_session(user_id: int, driver: uc.Chrome) -> bool:
@@ -186,7 +345,7 @@ def load_session(user_id: int, driver: uc.Chrome) -> bool:
 
     # Navigate to TikTok so the domain context exists before adding cookies
     driver.get("https://www.tiktok.com/")
-    time.sleep(1)
+    wait_for_page_ready(driver)
     # Inject each cookie into the browser session
     for cookie in cookies:
         cookie.pop("sameSite", None) # remove unsupported attribute if present
@@ -197,17 +356,21 @@ def load_session(user_id: int, driver: uc.Chrome) -> bool:
             print(f"[DEBUG] Skipping cookie: {cookie.get('name')} ({e})")
     # Refresh the page after loading the session cookies
     driver.refresh()
-    time.sleep(2)
+    wait_for_page_ready(driver)
     return True
 
 # ---------- Helpers for UI interaction ----------
-# Function to handle tiktok modals (confirmations or warnings)
-def confirm_or_close_modal_if_present(driver: uc.Chrome, post_click_phase: bool = False) -> None:
+# Function to handle tiktok modals (confirmations or warnings).
+# Only checks the current page by default, the upload and post waits call it while polling so modals are caught as they show up
+def confirm_or_close_modal_if_present(driver: uc.Chrome, post_click_phase: bool = False, timeout: float = 0) -> None:
     try:
-        # Waits for a modal container to appear on screen
-        modal = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, MODAL_CONTAINER_CSS))
-        )
+        if timeout:
+            # Waits for a modal container to appear on screen
+            modal = WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, MODAL_CONTAINER_CSS))
+            )
+        else:
+            modal = driver.find_elements(By.CSS_SELECTOR, MODAL_CONTAINER_CSS)[0]
     except Exception:
         return  # no modal present
 
@@ -231,13 +394,13 @@ def confirm_or_close_modal_if_present(driver: uc.Chrome, post_click_phase: bool
                 if post_click_phase and any(pl in label for pl in post_labels):
                     btn.click()
                     print(f"[INFO] Clicked post-confirm modal button: '{btn.text}'")
-                    time.sleep(1)
+                    wait_for_invisible(driver, modal)
                     return
                 # Otherwise, check regular confirm buttons
                 elif any(cl in label for cl in confirm_labels) or "copyright" in modal_text:
                     btn.click()
                     print(f"[INFO] Clicked confirm modal button: '{btn.text}'")
-                    time.sleep(1)
+                    wait_for_invisible(driver, modal)
                     return
             except Exception:
                 continue
@@ -246,26 +409,22 @@ def confirm_or_close_modal_if_present(driver: uc.Chrome, post_click_phase: bool
         if buttons:
             buttons[0].click()
             print("[INFO] Fallback clicked first modal button")
-            time.sleep(0.6)
+            wait_for_invisible(driver, modal)
     except Exception:
         pass
 
 # Function to open the visibility dropdown and set it public (Everyone)
 def find_and_set_visibility_public(driver: uc.Chrome) -> None:
     
-    # Common visible texts for the trigger button
-    texts_to_try = ["Everyone", "Public"]
     trigger = None
 
-    # Try to locate the dropdown trigger using the exact visible label
-    for txt in texts_to_try:
-        try:
-            trigger = WebDriverWait(driver, 4).until(
-                EC.element_to_be_clickable((By.XPATH, f"//button[.//div[text()='{txt}']]"))
-            )
-            break # Stops once found
-        except Exception:
-            continue
+    # Try to locate the dropdown trigger using the exact visible label (common texts: Everyone, Public)
+    try:
+        trigger = WebDriverWait(driver, 4, poll_frequency=0.1).until(
+            EC.element_to_be_clickable((By.XPATH, "//button[.//div[text()='Everyone' or text()='Public']]"))
+        )
+    except Exception:
+        pass
 
     # Fallback: look for combobox buttons and check their inner div for keywords
     if not trigger:
@@ -289,61 +448,99 @@ def find_and_set_visibility_public(driver: uc.Chrome) -> None:
 
     # Clicks the trigger, wait for options to render
     trigger.click()
-    time.sleep(random.uniform(0.4, 1.1))
+    humanize_pause(0.4, 1.1)
 
     # Finds the public option by data-value attribute (TikTok uses '"0"' for public)
     try:
-        public_opt = WebDriverWait(driver, 6).until(
+        public_opt = WebDriverWait(driver, 6, poll_frequency=0.1).until(
             EC.element_to_be_clickable((By.CSS_SELECTOR, "div[role='option'][data-value='&quot;0&quot;'], div[role='option'][data-value='\"0\"'], div[role='option'][data-value='0']"))
         )
         # Scrolls the option into view before clicking
         driver.execute_script("arguments[0].scrollIntoView({block:'center'});", public_opt)
-        time.sleep(0.3)
+        humanize_pause(0.2, 0.4)
         public_opt.click()
-        time.sleep(0.6)
+        # Waits for the dropdown to close
+        wait_for_invisible(driver, public_opt, timeout=3)
         return
     except Exception as e:
         # Last-resort: locate the option by visible text "Everyone" or "Public"
         try:
-            public_opt = WebDriverWait(driver, 4).until(
+            public_opt = WebDriverWait(driver, 4, poll_frequency=0.1).until(
                 EC.element_to_be_clickable((By.XPATH, "//div[@role='option']//div[contains(., 'Everyone') or contains(., 'Public')]"))
             )
             public_opt.click()
-            time.sleep(0.6)
+            wait_for_invisible(driver, public_opt, timeout=3)
             return
         except Exception:
             raise RuntimeError(f"Could not select 'Public' option: {e}")
 
+# Function to check if the post button can be clicked (TikTok keeps it disabled while the upload is processing)
+def is_post_button_enabled(driver: uc.Chrome) -> bool:
+    buttons = driver.find_elements(By.CSS_SELECTOR, POST_BTN_CSS)
+    if not buttons:
+        return False
+    btn = buttons[0]
+    return (
+        btn.is_enabled()
+        and btn.get_attribute("aria-disabled") != "true"
+        and btn.get_attribute("data-disabled") != "true"
+    )
+
+# Function to wait until the uploaded file finished processing, handling the modals (copyright / confirm) that show up meanwhile
+def wait_for_upload_complete(driver: uc.Chrome, timeout: float = TIKTOK_UPLOAD_TIMEOUT) -> None:
+    def upload_done(d) -> bool:
+        confirm_or_close_modal_if_present(d)
+        return is_post_button_enabled(d)
+
+    WebDriverWait(
+        driver, timeout, poll_frequency=0.25, ignored_exceptions=(StaleElementReferenceException,)
+    ).until(upload_done)
+
+# Function to check if the post went through: either URL fragment or a content element, handling any post-confirmation modal
+def is_post_confirmed(driver: uc.Chrome) -> bool:
+    confirm_or_close_modal_if_present(driver, post_click_phase=True)
+    return (
+        SUCCESS_URL_FRAGMENT in (driver.current_url or "")
+        or len(driver.find_elements(By.CSS_SELECTOR, "div.PostItem, [data-e2e='post-list-item']")) > 0
+    )
+
 # ---------- Main poster ----------
-# Function to post the video to tiktok
-def post_to_tiktok(user_id: int, final_video_path: str, description: str, headless: bool = True) -> bool:
+# Function to post the video to tiktok (None if the user has no tiktok session)
+def post_to_tiktok(user_id: int, final_video_path: str, description: str, headless: bool = True) -> bool | None:
     driver = None
+    # Only a driver that completed a post goes back to the pool, any other is recycled
+    reusable = False
+    # Seconds spent on each step of the post
+    timings = {}
     try:
         # Check DB for saved TikTok session cookies
         tokens = get_token_by_user_and_platform(user_id, "tiktok")
         if not tokens:
             print(f"[WARN] No TikTok tokens for user {user_id}.")
-            return False
+            return None
 
-        # Launch an undetected Chrome session
-        driver = create_driver(headless=headless) 
-        # Prevent deeplink redirects that can break the upload flow
-        block_onelink_and_intents(driver)
+        # Take a warm undetected Chrome session from the pool
+        with timed_step(timings, "driver"):
+            driver = acquire_driver(headless=headless)
 
         # Try to load session cookies; fall back to manual login if missing
-        if not load_session(user_id, driver):
+        with timed_step(timings, "session"):
+            session_loaded = load_session(user_id, driver)
+        if not session_loaded:
             print("[INFO] No cookies found: please log in interactively to seed cookies.")
-            driver.quit() # Closes old driver to start clean
+            release_driver(driver, reusable=False) # Closes old driver to start clean
+            driver = None
             login_and_save_session(user_id) # Manual login
-            driver = create_driver(headless=headless) # Starts a new driver to avoid stale context
-            block_onelink_and_intents(driver) # Re-apply deeplink blocker
+            driver = acquire_driver(headless=headless) # Starts a new driver to avoid stale context
             if not load_session(user_id, driver):
                 print("[ERROR] Failed to load session after interactive login.")
                 return False
 
-        # Navigate to tiktok upload page
-        driver.get(UPLOAD_URL)
-        time.sleep(3)  # Give JS time to load
+        # Navigate to tiktok upload page and wait for its JS to settle
+        with timed_step(timings, "upload_page"):
+            driver.get(UPLOAD_URL)
+            wait_for_page_ready(driver)
+            wait_for_network_idle(driver)
 
         # Validate video file path
         final_video_path = str(Path(final_video_path).resolve())
@@ -352,41 +549,52 @@ def post_to_tiktok(user_id: int, final_video_path: str, description: str, headle
             return False
 
         # Uploads file input
-        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, FILE_INPUT_CSS))).send_keys(final_video_path)
-        time.sleep(1.0)
-
-        # Handles any modal that may appear (copyright / confirm)
-        confirm_or_close_modal_if_present(driver)
-
-        # Fills caption
-        caption_box = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, CAPTION_CSS)))
-        caption_box.click()
-        caption_box.send_keys(Keys.CONTROL + "a") # Select all existing text
-        caption_box.send_keys(Keys.DELETE) # Clear it
-        caption_box.send_keys(description) # Enter new caption
-        time.sleep(random.uniform(0.7, 1.5))
+        with timed_step(timings, "file_input"):
+            WebDriverWait(driver, 20, poll_frequency=0.1).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, FILE_INPUT_CSS))
+            ).send_keys(final_video_path)
+
+            # Handles any modal that may appear (copyright / confirm)
+            confirm_or_close_modal_if_present(driver)
+
+        # Fills caption once the editor can take input
+        with timed_step(timings, "caption"):
+            caption_box = WebDriverWait(driver, 20, poll_frequency=0.1).until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, CAPTION_CSS))
+            )
+            caption_box.click()
+            caption_box.send_keys(Keys.CONTROL + "a") # Select all existing text
+            caption_box.send_keys(Keys.DELETE) # Clear it
+            caption_box.send_keys(description) # Enter new caption
+            humanize_pause(0.7, 1.5)
 
         # Sets visibility (Everyone)
-        find_and_set_visibility_public(driver)
+        with timed_step(timings, "visibility"):
+            find_and_set_visibility_public(driver)
+
+        # Waits for the upload to finish processing (the post button is enabled then)
+        with timed_step(timings, "processing"):
+            wait_for_upload_complete(driver)
 
         # Ensures the post button is visible and click it (JS click as fallback)
-        post_btn = WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.CSS_SELECTOR, POST_BTN_CSS)))
-        driver.execute_script("arguments[0].scrollIntoView({block:'center'});", post_btn)
-        time.sleep(random.uniform(1.4, 3.0))
-        try:
-            post_btn.click()
-        except Exception:
-            # Fallback to JS click if Selenium click fails
-            driver.execute_script("arguments[0].click();", post_btn)
-        
-        # Handles any post-confirmation modals
-        time.sleep(3.5)
-        confirm_or_close_modal_if_present(driver, post_click_phase=True)
-
-        # Wait for success: either URL fragment or a content element
+        with timed_step(timings, "post"):
+            post_btn = driver.find_element(By.CSS_SELECTOR, POST_BTN_CSS)
+            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", post_btn)
+            humanize_pause(1.4, 3.0)
+            try:
+                post_btn.click()
+            except Exception:
+                # Fallback to JS click if Selenium click fails
+                driver.execute_script("arguments[0].click();", post_btn)
+
+        # Wait for success, handling any post-confirmation modals meanwhile
         try:
-            WebDriverWait(driver, 120).until(lambda d: SUCCESS_URL_FRAGMENT in (d.current_url or "") or len(d.find_elements(By.CSS_SELECTOR, "div.PostItem, [data-e2e='post-list-item']")) > 0)
+            with timed_step(timings, "confirmation"):
+                WebDriverWait(
+                    driver, 120, poll_frequency=0.25, ignored_exceptions=(StaleElementReferenceException,)
+                ).until(is_post_confirmed)
             print(f"[SUCCESS] Video {final_video_path} posted to TikTok.")
+            reusable = True
             return True
         except Exception:
             # Save page screenshot for debugging
@@ -405,8 +613,6 @@ def post_to_tiktok(user_id: int, final_video_path: str, description: str, headle
         return False
 
     finally:
+        print_timings(timings)
         if driver:
-            try:
-                driver.quit()
-            except Exception:
-                pass
\ No newline at end of file
+            release_driver(driver, reusable)
@@ -1,30 +1,159 @@
 import requests
 import json
+import os
+import time
+import threading
+from requests.adapters import HTTPAdapter
 from src.crud.tokens_crud import get_token_by_user_and_platform
 
-def get_access_token(client_id:str, client_secret:str, refresh_token:int) -> str:    
-    response = requests.post(
-        "https://oauth2.googleapis.com/token",
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token"
+# Size of each upload request, rounded down to a multiple of 256 KiB as required by the resumable protocol.
+# Only one chunk is in memory at a time, so the memory of an upload doesn't depend on the video size
+YOUTUBE_CHUNK_BYTES = max(1, int(float(os.environ.get("YOUTUBE_CHUNK_MB", 8)) * 1024 * 1024) // (256 * 1024)) * 256 * 1024
+# Consecutive failed chunk requests before giving up on the upload
+YOUTUBE_UPLOAD_MAX_RETRIES = int(os.environ.get("YOUTUBE_UPLOAD_MAX_RETRIES", 5))
+# Status codes worth retrying (the session is still valid, the request just didn't go through)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Shared keep-alive session so the token, init and upload calls reuse pooled connections instead of a new handshake each
+youtube_session = requests.Session()
+youtube_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Access tokens by credential (client_id, refresh_token) as (access_token, expires_at monotonic time)
+access_tokens: dict[tuple[str, str], tuple[str, float]] = {}
+# One lock per credential so concurrent posts of the same channel refresh the token only once
+access_token_locks: dict[tuple[str, str], threading.Lock] = {}
+access_token_locks_lock = threading.Lock()
+# Cached tokens are refreshed this long before they expire, so a token never expires in the middle of a post
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+
+# Function to get an access token for a credential, reusing the cached one until it is about to expire
+def get_access_token(client_id:str, client_secret:str, refresh_token:int, force_refresh: bool = False) -> str:
+    key = (client_id, refresh_token)
+    with access_token_locks_lock:
+        lock = access_token_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        cached = access_tokens.get(key)
+        if cached and not force_refresh and time.monotonic() < cached[1] - TOKEN_REFRESH_MARGIN_SECONDS:
+            return cached[0]
+
+        response = youtube_session.post(
+            "https://oauth2.googleapis.com/token",
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "refresh_token": refresh_token,
+                "grant_type": "refresh_token"
+            },
+            timeout=30,
+        )
+        # Google returns invalid_grant if token expired or revoked 
+        if response.status_code == 400:
+            access_tokens.pop(key, None)
+            raise Exception("Refresh token expired :( Add a new one.")
+        response.raise_for_status()
+        token_data = response.json()
+        access_tokens[key] = (token_data["access_token"], time.monotonic() + token_data.get("expires_in", 3600))
+        return token_data["access_token"]
+
+# Helper function to read the committed offset of a resumable session from a 308 response (Range: bytes=0-<last byte>)
+def get_committed_offset(response: requests.Response) -> int:
+    range_header = response.headers.get("Range")
+    return int(range_header.rsplit("-", 1)[1]) + 1 if range_header else 0
+
+# Function to ask a resumable session how many bytes it has committed.
+# Returns (offset, None) while incomplete or (total, video) if the upload already completed
+def query_upload_status(upload_url: str, access_token: str, total_bytes: int) -> tuple[int, dict | None]:
+    response = youtube_session.put(
+        upload_url,
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Length": "0",
+            "Content-Range": f"bytes */{total_bytes}",
         },
-    )   
-    # Google returns invalid_grant if token expired or revoked 
-    if response.status_code == 400:
-        raise Exception("Refresh token expired :( Add a new one.")
+        timeout=60,
+    )
+    if response.status_code in (200, 201):
+        return total_bytes, response.json()
+    if response.status_code == 308:
+        return get_committed_offset(response), None
     response.raise_for_status()
-    token_data = response.json()
-    return token_data["access_token"]
+    raise Exception(f"Unexpected upload status response: {response.status_code}")
 
-def post_to_youtube(user_id:int, final_video_path:str, description:str, title:str) -> bool:
+# Function to upload a video to a resumable session chunk by chunk, streaming it from disk.
+# After a failed request the committed offset is queried so the upload resumes from there instead of byte 0
+def upload_video_chunks(upload_url: str, access_token: str, video_path: str) -> dict:
+    total_bytes = os.path.getsize(video_path)
+    offset = 0
+    failures = 0
+    sent_bytes = 0
+    start = time.perf_counter()
+
+    with open(video_path, "rb") as f:
+        while True:
+            if offset >= total_bytes:
+                # Everything is committed but the completion response was lost
+                _, video = query_upload_status(upload_url, access_token, total_bytes)
+                if video is None:
+                    raise Exception("Upload fully committed but the session didn't return the video")
+                return video
+
+            f.seek(offset)
+            chunk = f.read(YOUTUBE_CHUNK_BYTES)
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Length": str(len(chunk)),
+                "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{total_bytes}",
+                "Content-Type": "video/*",
+            }
+            try:
+                response = youtube_session.put(upload_url, headers=headers, data=chunk, timeout=300)
+                error = None
+            except requests.RequestException as e:
+                response, error = None, e
+
+            if response is not None:
+                sent_bytes += len(chunk)
+                if response.status_code in (200, 201):
+                    seconds = time.perf_counter() - start
+                    print(
+                        f"[INFO] Uploaded {total_bytes / 1e6:.1f} MB in {seconds:.1f}s "
+                        f"({total_bytes / 1e6 / max(seconds, 1e-6):.2f} MB/s, {sent_bytes / 1e6:.1f} MB sent)"
+                    )
+                    return response.json()
+                if response.status_code == 308:
+                    # Chunk committed (possibly partially, the next one starts where the server stopped)
+                    offset = get_committed_offset(response)
+                    failures = 0
+                    print(f"[INFO] Uploaded {offset / total_bytes:.0%} ({offset / 1e6:.1f}/{total_bytes / 1e6:.1f} MB)")
+                    continue
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                error = f"{response.status_code} {response.text[:200]}"
+
+            failures += 1
+            if failures > YOUTUBE_UPLOAD_MAX_RETRIES:
+                raise Exception(f"Upload failed after {YOUTUBE_UPLOAD_MAX_RETRIES} retries: {error}")
+            delay = 2 ** failures
+            print(f"[WARN] Upload chunk failed ({error}), resuming in {delay}s")
+            time.sleep(delay)
+
+            try:
+                offset, video = query_upload_status(upload_url, access_token, total_bytes)
+            except requests.RequestException as e:
+                print(f"[WARN] Could not query the upload status ({e}), resending the chunk")
+                continue
+            if video is not None:
+                return video
+
+# Function to post a video to youtube, returns the id of the posted video (None if the user has no youtube credentials)
+def post_to_youtube(user_id:int, final_video_path:str, description:str, title:str) -> str | None:
     # Query the tokens for youtube posting in the db and skip if not found
     tokens = get_token_by_user_and_platform(user_id, "youtube")
     if not tokens:
         print(f"No Youtube credentials found for user {user_id}. Skipping post.")
-        return False
+        return None
 
     client_id = tokens['client_id']
     client_secret = tokens['client_secret']
@@ -52,29 +181,23 @@ def post_to_youtube(user_id:int, final_video_path:str, description:str, title:st
 
         # Initiates a resumable upload session
         initiate_url = "https://www.googleapis.com/upload/youtube/v3/videos?uploadType=resumable&part=snippet,status"
-        init_resp = requests.post(initiate_url, headers=headers, json=metadata)
+        init_resp = youtube_session.post(initiate_url, headers=headers, json=metadata, timeout=60)
+        if init_resp.status_code == 401:
+            # The cached token was revoked before its expiry, retry once with a fresh one
+            access_token = get_access_token(client_id, client_secret, refresh_token, force_refresh=True)
+            headers["Authorization"] = f"Bearer {access_token}"
+            init_resp = youtube_session.post(initiate_url, headers=headers, json=metadata, timeout=60)
         init_resp.raise_for_status()
 
         upload_url = init_resp.headers["Location"]
 
-        # Upload the video bytes
-        final_video_data = None
-        with open(final_video_path, "rb") as f:
-            final_video_data = f.read()
-
-        upload_headers = {
-            "Authorization":f"Bearer {access_token}",
-            "Content-Length":str(len(final_video_data)),
-            "Content-Type":"video/*"
-        }   
-
-        upload_resp = requests.put(upload_url, headers=upload_headers, data = final_video_data)
-        upload_resp.raise_for_status()
-        video_result = upload_resp.json()
+        # Upload the video bytes in chunks
+        video_result = upload_video_chunks(upload_url, access_token, final_video_path)
 
         video_id = video_result.get("id")
         print(f"[SUCCESS] Video posted! Watch: https://www.youtube.com/watch?v={video_id}")
         print(f"[INFO] Short URL: https://www.youtube.com/shorts/{video_id}")
+        return video_id
     except Exception as e:
         print(f"[ERROR] Could not post video to youtube. Error: {e}")
-        return False
\ No newline at end of file
+        raise
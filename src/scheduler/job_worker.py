@@ -0,0 +1,115 @@
+import os
+import time
+import socket
+import threading
+import traceback
+from src.crud import job_crud
+from src.scheduler.scheduled_task import publish_for_slot
+
+# Seconds to wait before polling again when the queue is empty
+JOB_POLL_SECONDS = int(os.environ.get("JOB_POLL_SECONDS", 15))
+# Running jobs without a heartbeat for this long are considered crashed and picked up again
+JOB_STALE_MINUTES = int(os.environ.get("JOB_STALE_MINUTES", 10))
+# Seconds between heartbeats of a running job
+JOB_HEARTBEAT_SECONDS = 60
+# Base delay before retrying a failed job (doubles with every attempt)
+JOB_RETRY_BASE_SECONDS = int(os.environ.get("JOB_RETRY_BASE_SECONDS", 60))
+
+
+# Raised in a job that was claimed again by another worker (its heartbeats stopped for too long)
+class JobOwnershipLost(Exception):
+    pass
+
+
+# Helper function to turn a stage result into something that can be stored as the stage artifact
+def describe_artifact(stage: str, result):
+    if stage == "script":
+        scenes, title = result
+        return {"title": title, "scenes": len(scenes)}
+    if isinstance(result, (str, list, dict)):
+        return result
+    return None
+
+# Function to build the on_stage callback that records every stage of a job in video_jobs.
+# It stops the pipeline (before its next stage) once the job belongs to another worker
+def make_stage_recorder(job_id: int, worker_id: str, lost: threading.Event):
+    def on_stage(stage: str, status: str, seconds: float | None, result) -> None:
+        if lost.is_set():
+            raise JobOwnershipLost(f"job {job_id} was claimed by another worker")
+        stage_data = {"status": status}
+        if seconds is not None:
+            stage_data["seconds"] = round(seconds, 2)
+        if status in ("done", "reused"):
+            stage_data["artifact"] = describe_artifact(stage, result)
+        elif status == "failed":
+            stage_data["error"] = str(result)
+        try:
+            owned = job_crud.update_job_stage(job_id, worker_id, stage, stage_data)
+        except Exception as e:
+            # Tracking must never break the pipeline itself
+            print(f"[WARN] Could not record stage {stage} of job {job_id}: {e}")
+            return
+        if not owned:
+            lost.set()
+            raise JobOwnershipLost(f"job {job_id} was claimed by another worker")
+    return on_stage
+
+# Function to keep refreshing the heartbeat of a job until the stop event is set (or the job belongs to another worker)
+def heartbeat_loop(job_id: int, worker_id: str, stop: threading.Event, lost: threading.Event) -> None:
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not job_crud.heartbeat_job(job_id, worker_id):
+                print(f"[WARN] Job {job_id} was claimed by another worker, stopping after the current stage")
+                lost.set()
+                return
+        except Exception as e:
+            print(f"[WARN] Heartbeat failed for job {job_id}: {e}")
+
+# Function to run a single claimed job and record its outcome
+def process_job(job: dict, worker_id: str) -> None:
+    print(f"[INFO] Job {job['id']}: user {job['user_id']} slot {job['slot_at']:%A %H:00} (attempt {job['attempts']}/{job['max_attempts']})")
+    stop = threading.Event()
+    # Set once another worker claimed the job
+    lost = threading.Event()
+    heartbeat = threading.Thread(target=heartbeat_loop, args=(job["id"], worker_id, stop, lost), daemon=True)
+    heartbeat.start()
+    try:
+        final_video_path = publish_for_slot(
+            job["user_id"], job["slot_at"], on_stage=make_stage_recorder(job["id"], worker_id, lost)
+        )
+        if job_crud.complete_job(job["id"], worker_id, final_video_path):
+            print(f"✅ Job {job['id']} done: {final_video_path}")
+        else:
+            print(f"[WARN] Job {job['id']} finished ({final_video_path}) but was claimed by another worker meanwhile")
+    except JobOwnershipLost as e:
+        print(f"[WARN] Job {job['id']} stopped: {e}")
+    except Exception as e:
+        traceback.print_exc()
+        retry_delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        status = job_crud.fail_job(job["id"], worker_id, str(e), retry_delay)
+        if status is None:
+            print(f"[WARN] Job {job['id']} failed after being claimed by another worker, leaving it to that worker: {e}")
+        elif status == "queued":
+            print(f"[WARN] Job {job['id']} failed, retrying in {retry_delay}s: {e}")
+        else:
+            print(f"❌ Job {job['id']} failed permanently: {e}")
+    finally:
+        stop.set()
+        heartbeat.join()
+
+# Worker entry point: dequeues and runs jobs until interrupted (or until the queue is empty with once=True)
+def run_worker(once: bool = False) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"[INFO] Worker {worker_id} started")
+    try:
+        while True:
+            job = job_crud.dequeue_job(worker_id, JOB_STALE_MINUTES)
+            if job:
+                process_job(job, worker_id)
+                continue
+            if once:
+                print("[INFO] Queue is empty, exiting.")
+                return
+            time.sleep(JOB_POLL_SECONDS)
+    except KeyboardInterrupt:
+        print(f"[INFO] Worker {worker_id} stopped")
@@ -1,13 +1,158 @@
+import os
 import time, datetime
-from src.video_generator.generate_video import generate_video
-from src.crud import schedule_crud
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.video_generator.generate_video import generate_video, build_video, post_built_video, prepare_batched_scripts
+from src.video_generator.generate_script import SCRIPT_BATCHING
+from src.crud import schedule_crud, ready_video_crud, job_crud
+from src.utils.checkpoint import make_run_id
 
-def post_scheduled_content():
+# Max number of users processed at the same time in a single slot (can be overriden with CRON_MAX_WORKERS)
+DEFAULT_MAX_WORKERS = int(os.environ.get("CRON_MAX_WORKERS", 4))
+
+# Helper function to get the video rendered ahead for a user's slot, if it is still on disk
+def get_ready_video(user_id: int, slot_at: datetime.datetime | None) -> dict | None:
+    ready_video = ready_video_crud.get_ready_video(user_id, slot_at) if slot_at else None
+    return ready_video if ready_video and os.path.exists(ready_video["video_path"]) else None
+
+# Function to publish a user's video for a slot, only uploading it if it was rendered ahead.
+# Every attempt for the same slot shares a run id, so a retry resumes from the last completed stage
+def publish_for_slot(user_id: int, slot_at: datetime.datetime | None = None, on_stage=None) -> str:
+    run_id = make_run_id(user_id, slot_at) if slot_at else None
+    ready_video = get_ready_video(user_id, slot_at)
+    if ready_video:
+        print(f"[INFO] Posting pre-rendered video for user {user_id}: {ready_video['video_path']}")
+        post_built_video(user_id, {**ready_video, "run_id": run_id}, on_stage=on_stage)
+        ready_video_crud.mark_ready_video_posted(ready_video["id"])
+        return ready_video["video_path"]
+    return generate_video(user_id, on_stage, run_id)
+
+# Function to run the full pipeline for a single user, isolating any failure so it never affects the other users
+def run_user_pipeline(user_id: int, slot_at: datetime.datetime | None = None) -> dict:
+    start = time.perf_counter()
+    try:
+        final_video_path = publish_for_slot(user_id, slot_at)
+        return {
+            "user_id": user_id,
+            "status": "success",
+            "video_path": final_video_path,
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+    except Exception as e:
+        print(f"[ERROR] Pipeline failed for user {user_id}: {e}")
+        traceback.print_exc()
+        return {
+            "user_id": user_id,
+            "status": "failed",
+            "error": str(e),
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+
+# Function to build (but not post) a user's video for an upcoming slot and stage it in the ready queue
+def run_render_ahead(user_id: int, slot_at: datetime.datetime) -> dict:
+    start = time.perf_counter()
+    try:
+        video = build_video(user_id, run_id=make_run_id(user_id, slot_at))
+        ready_video_crud.create_ready_video(user_id, slot_at, video["title"], video["description"], video["video_path"])
+        return {
+            "user_id": user_id,
+            "status": "success",
+            "video_path": video["video_path"],
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+    except Exception as e:
+        print(f"[ERROR] Render ahead failed for user {user_id} ({slot_at:%A %H:00}): {e}")
+        traceback.print_exc()
+        return {
+            "user_id": user_id,
+            "status": "failed",
+            "error": str(e),
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+
+# Function to print a per user summary once every pipeline of the slot has finished
+def print_run_summary(results: list[dict], wall_seconds: float) -> None:
+    succeeded = [r for r in results if r["status"] == "success"]
+    failed = [r for r in results if r["status"] != "success"]
+
+    print("\n========== Scheduled run summary ==========")
+    for r in sorted(results, key=lambda r: r["user_id"]):
+        if r["status"] == "success":
+            print(f" ✅ user {r['user_id']}: {r['seconds']}s -> {r['video_path']}")
+        else:
+            print(f" ❌ user {r['user_id']}: {r['seconds']}s -> {r['error']}")
+    print(f"{len(succeeded)} succeeded, {len(failed)} failed, wall time {wall_seconds:.2f}s")
+    print("===========================================\n")
+
+# Helper function to prepare the scripts of a slot in batches, the batching is only a shortcut so a failure
+# just leaves every user to generate its own script
+def run_batched_scripts(jobs: list[tuple]) -> None:
+    try:
+        prepare_batched_scripts(jobs)
+    except Exception as e:
+        print(f"[WARN] Batched script generation failed, every user generates its own script: {e}")
+        traceback.print_exc()
+
+# Helper function to run a set of jobs over a bounded thread pool and print the summary
+def run_in_pool(fn, jobs: list[tuple], max_workers: int | None) -> list[dict]:
+    # Bound the pool so a busy slot doesn't exhaust API rate limits or local resources
+    max_workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(jobs)))
+    print(f"[INFO] Running {len(jobs)} job(s) with {max_workers} worker(s)")
+
+    start = time.perf_counter()
+    results = []
+    # Threads are used since the pipeline is mostly waiting on external APIs and uploads
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="autoshorts-user") as executor:
+        futures = [executor.submit(fn, *job) for job in jobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    print_run_summary(results, time.perf_counter() - start)
+    return results
+
+def post_scheduled_content(max_workers: int | None = None, enqueue: bool = False) -> list[dict]:
     now = datetime.datetime.now()
     current_day = now.strftime("%A")
     current_hour = now.hour
+    slot_at = now.replace(minute=0, second=0, microsecond=0)
 
     users_due = schedule_crud.get_users_to_post_at(current_day, current_hour)
+    if not users_due:
+        print(f"[INFO] No users scheduled for {current_day} at {current_hour:02d}:00")
+        return []
+
+    # In queue mode the slot is only recorded, the workers (main.py --worker) do the actual work
+    if enqueue:
+        for user_id in users_due:
+            job_id = job_crud.enqueue_job(user_id, slot_at)
+            print(f"[INFO] Enqueued job {job_id} for user {user_id}" if job_id else f"[INFO] User {user_id} already enqueued for this slot")
+        return []
+
+    jobs = [(user_id, slot_at) for user_id in users_due]
+    if SCRIPT_BATCHING:
+        # The users posting a video rendered ahead don't need a script
+        run_batched_scripts([job for job in jobs if not get_ready_video(*job)])
+    return run_in_pool(run_user_pipeline, jobs, max_workers)
+
+# Function to pre-build the videos of every slot in the next `hours` hours so the slot itself only uploads
+def render_ahead(hours: int, max_workers: int | None = None) -> list[dict]:
+    now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    # The current hour is left to the regular cron run
+    upcoming = [now + datetime.timedelta(hours=h) for h in range(1, hours + 1)]
+    slots_by_key = {(slot.strftime("%A"), slot.hour): slot for slot in upcoming}
+
+    already_staged = ready_video_crud.get_staged_slots(upcoming[0], upcoming[-1]) if upcoming else set()
+    jobs = []
+    for user_id, schedule_day, schedule_hour in schedule_crud.get_all_schedules():
+        slot_at = slots_by_key.get((schedule_day, schedule_hour))
+        if slot_at and (user_id, slot_at) not in already_staged:
+            jobs.append((user_id, slot_at))
+
+    if not jobs:
+        print(f"[INFO] Nothing to render for the next {hours} hour(s)")
+        return []
 
-    for user_id in users_due:
-        generate_video(user_id)
\ No newline at end of file
+    jobs.sort(key=lambda job: job[1]) # Earliest slots first
+    if SCRIPT_BATCHING:
+        run_batched_scripts(jobs)
+    return run_in_pool(run_render_ahead, jobs, max_workers)
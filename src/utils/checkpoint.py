@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+from src.utils.paths import get_run_manifest_path
+
+# Guards manifest writes since parallel stages (audio and images) finish at the same time
+manifest_lock = threading.Lock()
+
+
+# Util to build the run id of a user's scheduled slot, so every retry of that slot resumes the same run
+def make_run_id(user_id: int, slot_at: datetime.datetime) -> str:
+    return f"user_{user_id}_{slot_at:%Y%m%d_%H}"
+
+# Util to hash a file's content in chunks
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to load the manifest of a run (or start an empty one)
+def load_manifest(run_id: str, user_id: int | None = None) -> dict:
+    path = get_run_manifest_path(run_id)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"run_id": run_id, "user_id": user_id, "stages": {}}
+
+# Function to atomically write the manifest of a run
+def save_manifest(manifest: dict) -> None:
+    path = get_run_manifest_path(manifest["run_id"])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+# Helper to build a fingerprint of a stage from its result and the content of its files
+def stage_fingerprint(entry: dict) -> str:
+    payload = json.dumps({"result": entry["result"], "files": entry["files"]}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Function to get (True, result) of a completed stage if it can be reused, (False, None) otherwise.
+# A stage is valid when its files still have the recorded content hashes and its upstream
+# stages are unchanged since it ran (a re-run upstream stage invalidates everything after it)
+def get_valid_result(manifest: dict, stage: str, upstream: list[str]) -> tuple[bool, object]:
+    entry = manifest["stages"].get(stage)
+    if not entry:
+        return False, None
+
+    for up in upstream:
+        up_entry = manifest["stages"].get(up)
+        if not up_entry or entry["upstream"].get(up) != stage_fingerprint(up_entry):
+            return False, None
+
+    for path, sha256 in entry["files"].items():
+        if not os.path.exists(path) or file_sha256(path) != sha256:
+            return False, None
+    return True, entry["result"]
+
+# Function to record a completed stage with the content hash of its files
+def record_stage(manifest: dict, stage: str, result, files: list[str], upstream: list[str]) -> None:
+    with manifest_lock:
+        entry = {
+            "result": result,
+            "files": {path: file_sha256(path) for path in files},
+            "upstream": {up: stage_fingerprint(manifest["stages"][up]) for up in upstream if up in manifest["stages"]},
+            "completed_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        # Round trip through JSON so the in-memory entry matches what a later resume will load
+        manifest["stages"][stage] = json.loads(json.dumps(entry, default=str))
+        save_manifest(manifest)
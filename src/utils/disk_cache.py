@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from src.utils.paths import get_cache_dir
+
+# Guards the hit/miss counters and the eviction pass when several pipelines run in the same process
+cache_lock = threading.Lock()
+# Per namespace hit/miss counters of the current process
+cache_stats: dict[str, dict[str, int]] = {}
+
+
+# Util to build a content-addressed key from every input that affects the cached artifact
+def make_cache_key(**parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Helper to build the path of a cache entry (sharded by key prefix to keep folders small)
+def get_cache_path(namespace: str, key: str, ext: str) -> str:
+    shard_dir = os.path.join(get_cache_dir(namespace), key[:2])
+    os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, f"{key}{ext}")
+
+# Helper to count a hit or a miss for a namespace
+def record(namespace: str, outcome: str) -> None:
+    with cache_lock:
+        counters = cache_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+# Util to get the hit/miss counters of a namespace
+def get_stats(namespace: str) -> dict[str, int]:
+    with cache_lock:
+        return dict(cache_stats.get(namespace, {"hits": 0, "misses": 0}))
+
+# Function to look up an entry, returns its path on a hit or None on a miss
+def lookup(namespace: str, key: str, ext: str) -> str | None:
+    path = get_cache_path(namespace, key, ext)
+    if not os.path.exists(path):
+        record(namespace, "misses")
+        return None
+    # Bump the modification time so eviction treats it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    record(namespace, "hits")
+    return path
+
+# Function to add a file to the cache and evict the least recently used entries over the budget
+def store(namespace: str, key: str, ext: str, src_path: str, max_bytes: int) -> str:
+    path = get_cache_path(namespace, key, ext)
+    # Copy to a temp file first so readers never see a partially written entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict(namespace, max_bytes)
+    return path
+
+# Function to delete the least recently used entries until the namespace fits in its disk budget
+def evict(namespace: str, max_bytes: int) -> None:
+    with cache_lock:
+        entries = []
+        for root, _, files in os.walk(get_cache_dir(namespace)):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue # Removed by another process meanwhile
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        # Oldest first
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+# Util to detach a destination from the cache before a producer writes it.
+# A cache hit may have hard linked it to an entry, and writing through the link would overwrite the cached bytes
+def unlink_destination(dest_path: str) -> str:
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    return dest_path
+
+# Util to place a cached file at its destination, hard linking when possible and copying otherwise
+# (producers call unlink_destination before writing the destination again)
+def link_or_copy(src_path: str, dest_path: str) -> str:
+    unlink_destination(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        # Different filesystem or links not supported
+        shutil.copy2(src_path, dest_path)
+    return dest_path
@@ -0,0 +1,36 @@
+import subprocess
+import imageio_ffmpeg
+
+
+# Util to get the ffmpeg binary bundled with imageio-ffmpeg (already installed with moviepy)
+def get_ffmpeg_exe() -> str:
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+# Util to run ffmpeg with the given arguments, raising with its stderr if it fails
+def run_ffmpeg(args: list[str]) -> None:
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", *args]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"❌ ffmpeg failed ({proc.returncode}): {proc.stderr.strip()}")
+
+# Helper to quote a path for an ffmpeg concat list file
+def quote_concat_path(path: str) -> str:
+    return "'" + path.replace("\\", "/").replace("'", "'\\''") + "'"
+
+# Util to write a concat demuxer list, optionally with a duration per entry (for still images)
+def write_concat_list(list_path: str, paths: list[str], durations: list[float] | None = None) -> str:
+    with open(list_path, "w", encoding="utf-8") as f:
+        for i, path in enumerate(paths):
+            f.write(f"file {quote_concat_path(path)}\n")
+            if durations is not None:
+                f.write(f"duration {durations[i]:.3f}\n")
+        # The concat demuxer ignores the last duration unless the last file is repeated
+        if durations is not None and paths:
+            f.write(f"file {quote_concat_path(paths[-1])}\n")
+    return list_path
+
+# Function to join files with the same codecs into a single file without re-encoding
+def concat_copy(paths: list[str], output_path: str, list_path: str) -> str:
+    write_concat_list(list_path, paths)
+    run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path])
+    return output_path
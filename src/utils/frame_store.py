@@ -0,0 +1,24 @@
+import threading
+import numpy as np
+
+# In-process store of decoded frames keyed by their image path, so the stitcher can use a frame
+# straight from memory instead of decoding the JPEG written for archiving
+frames: dict[str, np.ndarray] = {}
+frames_lock = threading.Lock()
+
+
+# Util to keep a frame in memory for the given image path
+def put_frame(image_path: str, frame: np.ndarray) -> None:
+    with frames_lock:
+        frames[image_path] = frame
+
+# Util to get the in-memory frame of an image path (None if it only exists on disk)
+def get_frame(image_path: str) -> np.ndarray | None:
+    with frames_lock:
+        return frames.get(image_path)
+
+# Util to drop the frames once the video that uses them is rendered
+def release_frames(image_paths: list[str]) -> None:
+    with frames_lock:
+        for image_path in image_paths:
+            frames.pop(image_path, None)
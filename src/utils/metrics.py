@@ -0,0 +1,34 @@
+import os
+import json
+import threading
+from src.utils.paths import get_metrics_path
+
+# Guards the read-modify-write of the metrics files when several pipelines run in the same process
+metrics_lock = threading.Lock()
+
+
+# Util to get the persisted counters of a metrics file
+def load_counts(name: str) -> dict[str, int]:
+    path = get_metrics_path(name)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+# Util to add to the persisted counters of a metrics file
+# (the write is atomic, but concurrent processes may lose an increment which is fine for monitoring)
+def record_counts(name: str, **counts: int) -> dict[str, int]:
+    with metrics_lock:
+        totals = load_counts(name)
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+        path = get_metrics_path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(totals, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+        return totals
@@ -10,4 +10,24 @@ def get_output_dir(prompt_config_id: int, title:str) -> str:
         title.lower().replace(" ", "_")
     )
     os.makedirs(output_dir, exist_ok=True)
-    return output_dir
\ No newline at end of file
+    return output_dir
+# Util to generate the dir of a shared on-disk cache (e.g, images, audio)
+def get_cache_dir(namespace: str) -> str:
+    ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    cache_dir = os.path.join(ROOT_DIR, "cache", namespace)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# Util to generate the path of a run's checkpoint manifest (used to resume a failed run)
+def get_run_manifest_path(run_id: str) -> str:
+    ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    runs_dir = os.path.join(ROOT_DIR, "output", "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+    return os.path.join(runs_dir, f"{run_id}.json")
+
+# Util to generate the path of a persisted metrics file (e.g, script parsing failures)
+def get_metrics_path(name: str) -> str:
+    ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    metrics_dir = os.path.join(ROOT_DIR, "output", "metrics")
+    os.makedirs(metrics_dir, exist_ok=True)
+    return os.path.join(metrics_dir, f"{name}.json")
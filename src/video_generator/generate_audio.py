@@ -1,14 +1,86 @@
 from elevenlabs.client import ElevenLabs
 from elevenlabs import save
+from concurrent.futures import ThreadPoolExecutor
 from src.utils.paths import get_output_dir
+from src.utils import disk_cache, ffmpeg
 import os
 
 
 # Eleven labs set up
 elevenlabs = ElevenLabs(api_key=os.environ["ELEVENLABS_API_KEY"])
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
+
+# Per scene synthesis settings (each scene is synthesized and cached on its own, then the clips are joined)
+TTS_PER_SCENE = os.environ.get("TTS_PER_SCENE", "").lower() in ("1", "true", "yes")
+# Max number of scene requests in flight at the same time
+TTS_MAX_IN_FLIGHT = int(os.environ.get("TTS_MAX_IN_FLIGHT", 4))
+# Disk budget of the narration clip cache
+AUDIO_CACHE_MAX_MB = int(os.environ.get("AUDIO_CACHE_MAX_MB", 512))
+
+
+# Function to synthesize a single scene clip, reusing the cached clip when the same text was already spoken by that voice
+def synthesize_scene_clip(text: str, voice_id: str, clip_path: str) -> str:
+    cache_key = disk_cache.make_cache_key(
+        voice_id=voice_id, model_id=TTS_MODEL_ID, output_format=TTS_OUTPUT_FORMAT, text=text
+    )
+    cached_path = disk_cache.lookup("audio", cache_key, ".mp3")
+    if cached_path:
+        return disk_cache.link_or_copy(cached_path, clip_path)
+
+    audio = elevenlabs.text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id=TTS_MODEL_ID,
+        output_format=TTS_OUTPUT_FORMAT,
+    )
+    save(audio, disk_cache.unlink_destination(clip_path))
+    disk_cache.store("audio", cache_key, ".mp3", clip_path, AUDIO_CACHE_MAX_MB * 1024 * 1024)
+    return clip_path
+
+# Helper function to build the narration clip path of a scene
+def get_scene_clip_path(output_dir: str, index: int) -> str:
+    clips_dir = os.path.join(output_dir, "narration_clips")
+    os.makedirs(clips_dir, exist_ok=True)
+    return os.path.join(clips_dir, f"scene_{index + 1}.mp3")
+
+# Function to join the scene clips into the narration (same format, so no re-encoding)
+def join_scene_clips(clip_paths: list[str], output_dir: str, audio_path: str) -> str:
+    ffmpeg.concat_copy(clip_paths, audio_path, os.path.join(output_dir, "narration_clips", "clips.txt"))
+    stats = disk_cache.get_stats("audio")
+    print(f"🔊 Narration clips: {stats['hits']} cache hits / {stats['misses']} misses this process")
+    return audio_path
+
+# Function to synthesize every scene concurrently and join the clips
+def generate_audio_per_scene(script: list[dict], voice_id: str, output_dir: str, audio_path: str) -> str:
+    with ThreadPoolExecutor(max_workers=TTS_MAX_IN_FLIGHT, thread_name_prefix="autoshorts-tts") as executor:
+        futures = [
+            executor.submit(synthesize_scene_clip, scene["narration"], voice_id, get_scene_clip_path(output_dir, i))
+            for i, scene in enumerate(script)
+        ]
+        # Results keep the scene order
+        clip_paths = [future.result() for future in futures]
+
+    return join_scene_clips(clip_paths, output_dir, audio_path)
+
+# Function to join the clips synthesized while the script was streaming into the narration of the video
+def join_streamed_clips(clip_paths: list[str], title: str, prompt_config_id: int) -> str:
+    output_dir = get_output_dir(prompt_config_id, title)
+    audio_path = join_scene_clips(clip_paths, output_dir, os.path.join(output_dir, "narration.mp3"))
+    print(f"✅ Audio saved to {audio_path}")
+    return audio_path
 
 
 def generate_audio(script: list[dict], voice_id:str, title: str, prompt_config_id:int) -> str:
+    # Recreates output directory path
+    output_dir = get_output_dir(prompt_config_id, title)
+    audio_path = os.path.join(output_dir, "narration.mp3")
+
+    if TTS_PER_SCENE:
+        generate_audio_per_scene(script, voice_id, output_dir, audio_path)
+        print(f"✅ Audio saved to {audio_path}")
+        return audio_path
+
     # Combines the narration from all scenes
     narration = " ".join([scene["narration"] for scene in script])
 
@@ -16,16 +88,12 @@ def generate_audio(script: list[dict], voice_id:str, title: str, prompt_config_i
     audio = elevenlabs.text_to_speech.convert(
     text=narration,
     voice_id=voice_id,
-    model_id="eleven_multilingual_v2",
-    output_format="mp3_44100_128",
+    model_id=TTS_MODEL_ID,
+    output_format=TTS_OUTPUT_FORMAT,
     )
 
-    # Recreates output directory path
-    output_dir = get_output_dir(prompt_config_id, title)
-
     # Saves the audio
-    audio_path = os.path.join(output_dir, "narration.mp3")
     save(audio, audio_path)
     print(f"✅ Audio saved to {audio_path}")
 
-    return audio_path
\ No newline at end of file
+    return audio_path
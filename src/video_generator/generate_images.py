@@ -1,63 +1,70 @@
 import requests
 import os
+import io
+import base64
+import time
+import random
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from requests.adapters import HTTPAdapter
 from PIL import Image
 from src.utils.paths import get_output_dir
+from src.utils import disk_cache, frame_store
 
 # Boolean to decide  if a local image generator will be used instead of stability
 USE_LOCAL_IMG_MODEL = os.environ.get("STABILITY_API_KEY") is None
 
-# If the local model will be use installs it
-if USE_LOCAL_IMG_MODEL:
-    import torch
-    from diffusers import StableDiffusionPipeline
+# Local model settings (GPU friendly size while keeping 9:16 ratio for later resize)
+LOCAL_IMG_MODEL_ID = "runwayml/stable-diffusion-v1-5"
+LOCAL_IMG_HEIGHT, LOCAL_IMG_WIDTH = 1136, 640
+# Inference profile of the local model (see LOCAL_IMG_PROFILES in image_model), "auto" picks "gpu" or "cpu-quality"
+LOCAL_IMG_PROFILE = os.environ.get("LOCAL_IMG_PROFILE", "auto").lower()
+# Optional override of the number of denoising steps of the profile
+LOCAL_IMG_STEPS = int(os.environ["LOCAL_IMG_STEPS"]) if os.environ.get("LOCAL_IMG_STEPS") else None
 
-    # Load the model into a project local folder 
-    # (Note: it will not install every run but only if it is not there or only corrupted sections)
-    pipe = StableDiffusionPipeline.from_pretrained(
-        "runwayml/stable-diffusion-v1-5",
-        cache_dir="models/", # Set a local folder instaed of ~/.cache default
-        torch_dtype=torch.float16
-    )
-    # Use GPU if available, otherwise fallback to CPU
-    pipe = pipe.to("cuda" if torch.cuda.is_available() else "cpu")
+# Optional fixed seed for reproducible images (random when not set)
+IMAGE_SEED = int(os.environ["IMAGE_SEED"]) if os.environ.get("IMAGE_SEED") else None
 
+# Content-addressed image cache settings
+IMAGE_CACHE_MAX_MB = int(os.environ.get("IMAGE_CACHE_MAX_MB", 2048))
+# Set to skip the cache lookups (generated images are still stored)
+IMAGE_CACHE_BYPASS = os.environ.get("IMAGE_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
 
+# In-memory handoff (local model only): the frames go straight to the stitcher at the final size
+# and the JPEGs are only written in the background for archiving (IN_MEMORY_ARCHIVE=0 skips them)
+IN_MEMORY_FRAMES = os.environ.get("IN_MEMORY_FRAMES", "").lower() in ("1", "true", "yes")
+IN_MEMORY_ARCHIVE = os.environ.get("IN_MEMORY_ARCHIVE", "1").lower() in ("1", "true", "yes")
+archive_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="autoshorts-archive")
+# Pending background JPEG writes by image path
+archive_futures: dict[str, Future] = {}
 
-def generate_images(script: list[dict], title: str, prompt_config_id: int) -> list[str]:
-    image_paths = []  # Stores the paths to the generated image files
+# Resident image model server (see `main.py --image-server`), used instead of loading the model in process when running
+IMAGE_SERVER_URL = os.environ.get("IMAGE_SERVER_URL", "http://127.0.0.1:8765")
 
-    # Create the directory for the images
-    output_dir = get_output_dir(prompt_config_id, f"{title}/images")
-    print(f"🧠 Using {'local model' if USE_LOCAL_IMG_MODEL else 'Stability API'} for image generation.")
+# Stability API settings
+STABILITY_URL = "https://api.stability.ai/v2beta/stable-image/generate/core"
+# Max number of scene requests in flight at the same time
+STABILITY_MAX_IN_FLIGHT = int(os.environ.get("STABILITY_MAX_IN_FLIGHT", 6))
+# Max number of attempts per scene before giving up on it
+STABILITY_MAX_ATTEMPTS = int(os.environ.get("STABILITY_MAX_ATTEMPTS", 4))
+# Status codes worth retrying (rate limited or server side errors)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
 
-    for i, scene in enumerate(script):
-        print(f"Generating image for Scene {i + 1}: {scene['scene_id']}")
-        
-        # Check if the local model is being used
-        if USE_LOCAL_IMG_MODEL:
-            # Local generation (GPU friendly size while keeping 9:16 ratio for later resize)
-            image = pipe(scene["image_prompt"], height=1136, width=640).images[0]
-            image = image.resize((1080, 1920), resample=Image.LANCZOS)
-
-            # Convert to YCbCr (baseline JPEG color space)
-            image = image.convert("YCbCr")
-
-            
-            # Save clean JPEG (baseline, no subsampling, no metadata)
-            image_path = os.path.join(output_dir, f"scene_{i + 1}_{scene['scene_id']}.jpg")
-            image.save(
-                image_path, 
-                format="JPEG",
-                quality=90, # quality=90 balance image quality along with image size
-                subsampling=0, # full-resolution chroma (avoids ffmpeg subsampling bugs)
-                optimize=True, # smaller but still baseline
-                progressive=False  # disable progressive encoding
-                )
-            image_paths.append(image_path)
-        else:
-            # Request to the stability API
-            response = requests.post(
-                "https://api.stability.ai/v2beta/stable-image/generate/core",
+# Shared keep-alive session so every scene reuses the same pooled connections
+stability_session = requests.Session()
+stability_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=STABILITY_MAX_IN_FLIGHT))
+
+
+# Helper function to build the image file path of a scene
+def get_scene_image_path(output_dir: str, index: int, scene: dict) -> str:
+    return os.path.join(output_dir, f"scene_{index + 1}_{scene['scene_id']}.jpg")
+
+# Function to request a single scene image to the stability API, retrying it on its own with exponential backoff
+def generate_stability_image(scene: dict, image_path: str) -> str:
+    for attempt in range(1, STABILITY_MAX_ATTEMPTS + 1):
+        try:
+            response = stability_session.post(
+                STABILITY_URL,
                 headers={
                     "authorization": f"Bearer {os.environ['STABILITY_API_KEY']}",
                     "accept": "image/*"
@@ -68,18 +75,230 @@ def generate_images(script: list[dict], title: str, prompt_config_id: int) -> li
                     "output_format": "jpeg",
                     # to ensure 9:16 aspect ratio
                     "width": 1080,
-                    "height": 1920
+                    "height": 1920,
+                    **({"seed": IMAGE_SEED} if IMAGE_SEED is not None else {})
                 },
+                timeout=120,
             )
+        except requests.RequestException as e:
+            error = f"request error: {e}"
+        else:
             if response.status_code == 200:
-                image_path = os.path.join(output_dir, f"scene_{i + 1}_{scene['scene_id']}.jpg")
-                with open(image_path, 'wb') as f:
+                with open(disk_cache.unlink_destination(image_path), 'wb') as f:
                     f.write(response.content)
-                image_paths.append(image_path)
+                return image_path
+
+            error = f"{response.status_code}\n{response.text}"
+            # Client errors (bad prompt, moderation, auth) will fail the same way if retried
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                break
+
+        if attempt < STABILITY_MAX_ATTEMPTS:
+            # Exponential backoff with jitter so the retried scenes don't hit the API at the same time
+            delay = 2 ** attempt + random.uniform(0, 1)
+            print(f"[WARN] Scene {scene['scene_id']} failed (attempt {attempt}/{STABILITY_MAX_ATTEMPTS}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    raise Exception(f"❌ Image generation failed for scene {scene['scene_id']}: {error}")
+
+# Function to request every scene concurrently to the stability API, the results keep the scene order
+def generate_stability_images(scenes: list[dict], target_paths: list[str]) -> list[str]:
+    image_paths = []
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=STABILITY_MAX_IN_FLIGHT, thread_name_prefix="autoshorts-stability") as executor:
+        futures = []
+        for scene, image_path in zip(scenes, target_paths):
+            print(f"Generating image for Scene {scene['scene_id']}")
+            futures.append(executor.submit(generate_stability_image, scene, image_path))
+
+        # Wait for every scene so the ones that succeeded are kept on disk even if another one fails
+        for future in futures:
+            try:
+                image_paths.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+
+    if errors:
+        raise Exception("\n".join(errors))
+    return image_paths
+
+
+# Function to save a locally generated image with the same layout as the stability ones
+def save_local_image(image: Image.Image, image_path: str) -> str:
+    if image.size != (1080, 1920):
+        image = image.resize((1080, 1920), resample=Image.LANCZOS)
+
+    # Convert to YCbCr (baseline JPEG color space)
+    image = image.convert("YCbCr")
+
+    # Save clean JPEG (baseline, no subsampling, no metadata)
+    image.save(
+        disk_cache.unlink_destination(image_path), 
+        format="JPEG",
+        quality=90, # quality=90 balance image quality along with image size
+        subsampling=0, # full-resolution chroma (avoids ffmpeg subsampling bugs)
+        optimize=True, # smaller but still baseline
+        progressive=False  # disable progressive encoding
+        )
+    return image_path
+
+# Helper function to check if the resident image model server is up
+def image_server_available() -> bool:
+    try:
+        return requests.get(f"{IMAGE_SERVER_URL}/health", timeout=1).status_code == 200
+    except requests.RequestException:
+        return False
+
+# Helper function to get the profile of the resident image model server, None if it isn't up
+def get_image_server_profile() -> str | None:
+    try:
+        response = requests.get(f"{IMAGE_SERVER_URL}/health", timeout=1)
+        if response.status_code != 200:
+            return None
+        return response.json().get("profile") or "unknown" # Servers started before the profile was reported
+    except (requests.RequestException, ValueError):
+        return None
+
+# Helper function to describe the local model and resolved profile that will generate the images
+# (the server's own profile when it is up, since its environment may differ from this process)
+def get_local_model_key() -> str:
+    server_profile = get_image_server_profile()
+    if server_profile:
+        return f"{LOCAL_IMG_MODEL_ID}:{server_profile}"
+    # Only imported when needed so processes using the stability API never load torch
+    from src.video_generator import image_model
+    return f"{LOCAL_IMG_MODEL_ID}:{image_model.get_profile_key()}"
+
+# Function to send a generation job to the resident image model server
+def generate_images_with_server(prompts: list[str]) -> list[Image.Image]:
+    response = requests.post(f"{IMAGE_SERVER_URL}/generate", json={"prompts": prompts, "seed": IMAGE_SEED}, timeout=None)
+    if response.status_code != 200:
+        raise Exception(f"❌ Image server generation failed: {response.status_code}\n{response.text}")
+    return [Image.open(io.BytesIO(base64.b64decode(data))) for data in response.json()["images"]]
+
+# Function to write the archive JPEG of an in-memory frame and add it to the cache
+def archive_frame(frame: np.ndarray, image_path: str, cache_key: str) -> str:
+    save_local_image(Image.fromarray(frame), image_path)
+    disk_cache.store("images", cache_key, ".jpg", image_path, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+    return image_path
+
+# Function to wait for the background JPEG writes of the given images.
+# Returns the paths once they are all on disk, or None if some only exist in memory (archiving disabled)
+def wait_for_archive(image_paths: list[str]) -> list[str] | None:
+    pending = [archive_futures.pop(path) for path in image_paths if path in archive_futures]
+    wait(pending)
+    for future in pending:
+        future.result() # Surface write errors
+    return image_paths if all(os.path.exists(path) for path in image_paths) else None
+
+# Function to forget the background JPEG writes of the given images without waiting for them (the writes still finish)
+def discard_archive(image_paths: list[str]) -> None:
+    for path in image_paths:
+        archive_futures.pop(path, None)
+
+# Function to generate the scenes with the local model, preferring the warm server over loading the pipeline in process
+def generate_local_images(
+    scenes: list[dict],
+    target_paths: list[str],
+    in_memory: bool = False,
+    cache_keys: list[str] | None = None
+) -> list[str]:
+    prompts = [scene["image_prompt"] for scene in scenes]
+
+    if image_server_available():
+        print(f"🧠 Using the image model server at {IMAGE_SERVER_URL}")
+        images = generate_images_with_server(prompts)
+    else:
+        # Only imported when needed so processes using the server (or stability) never load torch
+        from src.video_generator import image_model
+        images = image_model.generate_local_batch(prompts, IMAGE_SEED)
+
+    if not in_memory:
+        return [save_local_image(image, image_path) for image, image_path in zip(images, target_paths)]
+
+    # Single resize to the final size, the stitcher uses the frames as they are
+    for i, (image, image_path) in enumerate(zip(images, target_paths)):
+        frame = np.asarray(image.convert("RGB").resize((1080, 1920), resample=Image.LANCZOS))
+        frame_store.put_frame(image_path, frame)
+        if IN_MEMORY_ARCHIVE:
+            archive_futures[image_path] = archive_executor.submit(archive_frame, frame, image_path, cache_keys[i])
+    return target_paths
+
+# Helper function to build the cache key of a scene image from everything that changes the output
+# (local_model is the get_local_model_key of the local model, computed once per video by the callers)
+def get_image_cache_key(prompt: str, local_model: str | None = None) -> str:
+    if USE_LOCAL_IMG_MODEL:
+        # The resolved profile (device, precision, scheduler, steps) changes the output of the same model
+        model = local_model or get_local_model_key()
+        backend, resolution = "local", f"{LOCAL_IMG_WIDTH}x{LOCAL_IMG_HEIGHT}"
+    else:
+        backend, model, resolution = "stability", STABILITY_URL, "1080x1920"
+    return disk_cache.make_cache_key(prompt=prompt, backend=backend, model=model, resolution=resolution, seed=IMAGE_SEED)
+
+
+# Function to generate (or reuse from the cache) the image of a single scene, so scenes can start while the script is still streaming
+def generate_scene_image(scene: dict, index: int, title: str, prompt_config_id: int, use_cache: bool = True) -> str:
+    output_dir = get_output_dir(prompt_config_id, f"{title}/images")
+    image_path = get_scene_image_path(output_dir, index, scene)
+    cache_key = get_image_cache_key(scene["image_prompt"])
+
+    cached_path = disk_cache.lookup("images", cache_key, ".jpg") if use_cache and not IMAGE_CACHE_BYPASS else None
+    if cached_path:
+        print(f"♻️ Reused cached image for Scene {index + 1}: {scene['scene_id']}")
+        return disk_cache.link_or_copy(cached_path, image_path)
+
+    if USE_LOCAL_IMG_MODEL and IN_MEMORY_FRAMES:
+        # The background archive adds it to the cache once written
+        return generate_local_images([scene], [image_path], in_memory=True, cache_keys=[cache_key])[0]
+
+    print(f"Generating image for Scene {scene['scene_id']}")
+    if USE_LOCAL_IMG_MODEL:
+        generate_local_images([scene], [image_path])
+    else:
+        generate_stability_image(scene, image_path)
+    disk_cache.store("images", cache_key, ".jpg", image_path, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+    return image_path
+
+# (with IN_MEMORY_FRAMES the returned paths may only be in memory for now, see frame_store and wait_for_archive)
+def generate_images(script: list[dict], title: str, prompt_config_id: int, use_cache: bool = True) -> list[str]:
+    # Create the directory for the images
+    output_dir = get_output_dir(prompt_config_id, f"{title}/images")
+    print(f"🧠 Using {'local model' if USE_LOCAL_IMG_MODEL else 'Stability API'} for image generation.")
+    use_cache = use_cache and not IMAGE_CACHE_BYPASS
+
+    image_paths = [get_scene_image_path(output_dir, i, scene) for i, scene in enumerate(script)]
+    local_model = get_local_model_key() if USE_LOCAL_IMG_MODEL else None
+    cache_keys = [get_image_cache_key(scene["image_prompt"], local_model) for scene in script]
+
+    # Reuse the cached scenes and only generate the missing ones
+    missing = []
+    for i, image_path in enumerate(image_paths):
+        cached_path = disk_cache.lookup("images", cache_keys[i], ".jpg") if use_cache else None
+        if cached_path:
+            disk_cache.link_or_copy(cached_path, image_path)
+            print(f"♻️ Reused cached image for Scene {i + 1}: {script[i]['scene_id']}")
+        else:
+            missing.append(i)
+
+    if missing:
+        scenes = [script[i] for i in missing]
+        target_paths = [image_paths[i] for i in missing]
+        # Check if the local model is being used
+        if USE_LOCAL_IMG_MODEL and IN_MEMORY_FRAMES:
+            # The background archive adds them to the cache once written
+            generate_local_images(scenes, target_paths, in_memory=True, cache_keys=[cache_keys[i] for i in missing])
+        else:
+            if USE_LOCAL_IMG_MODEL:
+                generate_local_images(scenes, target_paths)
             else:
-                raise Exception(f"❌ Image generation failed: {response.status_code}\n{response.json()}")
+                generate_stability_images(scenes, target_paths)
+
+            for i in missing:
+                disk_cache.store("images", cache_keys[i], ".jpg", image_paths[i], IMAGE_CACHE_MAX_MB * 1024 * 1024)
 
-    print("✅ All images generated.")
+    stats = disk_cache.get_stats("images")
+    print(f"✅ All images generated. (cache: {len(script) - len(missing)} reused this video, {stats['hits']} hits / {stats['misses']} misses this process)")
     return image_paths
     # return [
     # r"output\placeholder_imgs\hohftp1.jpg",
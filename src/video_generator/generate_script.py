@@ -1,15 +1,77 @@
 import json
 import re
 import os
-from typing import Tuple
+import difflib
+from collections import Counter
+from typing import Tuple, Iterable, Iterator
+# pydantic (used by the SDK to convert the schemas) only accepts typing_extensions.TypedDict before Python 3.12
+from typing_extensions import TypedDict
 import google.generativeai as genai
 from src.crud import prompt_crud
+from src.utils import metrics
 from src.utils.paths import get_output_dir
 
 # Google gemini set up
 genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 text_model = genai.GenerativeModel('gemini-2.5-flash')
 
+# Streaming mode: the response is parsed while it arrives and every scene is handed over as soon as it is complete,
+# so the images and narration of the first scenes start while Gemini is still writing the last ones
+SCRIPT_STREAMING = os.environ.get("SCRIPT_STREAMING", "").lower() in ("1", "true", "yes")
+
+# Patterns to find the (complete) title and the start of the scenes array in a partial response
+TITLE_PATTERN = re.compile(r'"title"\s*:\s*"((?:[^"\\]|\\.)*)"')
+SCENES_PATTERN = re.compile(r'"scenes"\s*:\s*\[')
+
+# Batch mode: the scripts of the users due in the same slot are requested together (a few users per request),
+# a user whose script is invalid in the batch falls back to its own request
+SCRIPT_BATCHING = os.environ.get("SCRIPT_BATCHING", "").lower() in ("1", "true", "yes")
+# Max number of users per batched request
+SCRIPT_BATCH_MAX_USERS = int(os.environ.get("SCRIPT_BATCH_MAX_USERS", 5))
+
+# Rounds of repair (local fixes, then a re-prompt for the fields still invalid) before failing the script
+SCRIPT_MAX_REPAIRS = int(os.environ.get("SCRIPT_MAX_REPAIRS", 2))
+# Number of most recent covered topics listed in the prompt (older ones are only checked locally)
+PROMPT_RECENT_TOPICS = int(os.environ.get("PROMPT_RECENT_TOPICS", 30))
+# Similarity (0-1) from which a new title counts as a near duplicate of a covered topic
+TOPIC_SIMILARITY_THRESHOLD = float(os.environ.get("TOPIC_SIMILARITY_THRESHOLD", 0.85))
+# Scripts requested before keeping a title that is a near duplicate of a covered topic
+SCRIPT_MAX_TOPIC_ATTEMPTS = int(os.environ.get("SCRIPT_MAX_TOPIC_ATTEMPTS", 3))
+# Path of a scene field in the repair requests (e.g, scenes[2].narration)
+FIELD_PATH_PATTERN = re.compile(r"scenes\[(\d+)\]\.(\w+)")
+
+
+# Declared output schema of a script
+class Scene(TypedDict):
+    scene_id: str
+    narration: str
+    image_prompt: str
+    duration: float
+
+class Script(TypedDict):
+    title: str
+    scenes: list[Scene]
+
+# Script of one of the requests of a batch (see generate_scripts_batch)
+class BatchScript(TypedDict):
+    request: str
+    title: str
+    scenes: list[Scene]
+
+# Corrected value of a single invalid field, returned by the repair requests
+class FieldFix(TypedDict):
+    field: str
+    value: str
+
+SCRIPT_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json", response_schema=Script)
+BATCH_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json", response_schema=list[BatchScript])
+REPAIR_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json", response_schema=list[FieldFix])
+CONTINUATION_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json", response_schema=list[Scene])
+# Gemini orders the properties of a response_schema alphabetically (scenes before title) unless propertyOrdering is
+# given, and the pinned SDK's Schema has no such field. The streamed scripts need the title first, so they are
+# requested in plain JSON mode and follow the key order of the prompt (the result is still validated and repaired)
+STREAM_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json")
+
 # Helper function to format the gemini response as JSON
 def extract_json_from_gemini(text: str):
     # Try to match markdown-style JSON block
@@ -31,52 +93,420 @@ def extract_json_from_gemini(text: str):
         print(json_str)
         raise e
 
-# Helper function to generate the prompt
-def build_prompt(topic: str,scope: str,covered_topics: list[str],wpm:int) -> str:
+# Shared part of the prompts: the format of a scene and of the answer
+SCENE_FORMAT = (
+    "Each item must include:\n"
+    "- scene_id: a short label \n"
+    "- narration: 1–2 sentences that sound natural when spoken aloud\n"
+    "- image_prompt: a visual prompt for AI image generation\n"
+    "- duration: estimated seconds based on narration length\n\n"
+)
+TITLE_FORMAT = "a **very short** identifier for the subtopic (e.g., 'scalpel', 'falafel', or 'espresso'), ideally 1–2 words"
+
+# Helper function to generate the user specific part of the prompt
+def build_request(topic: str, scope: str, covered_topics: list[str], wpm: int) -> str:
     words_per_sec = round(60 / wpm, 2)
     topics_str = ', '.join(covered_topics) if covered_topics else "none"
-    
+
     return (
         f"Write a structured JSON array educational video about the  the {scope} of a {topic} "
-        f"that has not been covered already in: {topics_str}. "
+        f"that has not been covered already in (most recent first): {topics_str}. "
         "The video must last no more than 60 seconds total. "
         "Use 5–6 scenes. The total word count across all 'narration' fields must not exceed "
         f"{int(wpm)} words. "
         f"The text will be read aloud using a voice model that speaks at approximately 1 word per {words_per_sec} seconds. "
         "Base the estimated 'duration' of each scene on how long its narration would take to read aloud at this pace. "
-        "Each item must include:\n"
-        "- scene_id: a short label \n"
-        "- narration: 1–2 sentences that sound natural when spoken aloud\n"
-        "- image_prompt: a visual prompt for AI image generation\n"
-        "- duration: estimated seconds based on narration length\n\n"
-        "Return a JSON object with two keys:\n"
-        "- 'title': a **very short** identifier for the subtopic (e.g., 'scalpel', 'falafel', or 'espresso'), ideally 1–2 words\n"
-        "- 'scenes': an array of the scenes described above"
     )
 
+# Helper function to generate the prompt
+def build_prompt(topic: str,scope: str,covered_topics: list[str],wpm:int) -> str:
+    return (
+        build_request(topic, scope, covered_topics, wpm)
+        + SCENE_FORMAT
+        + "Return a JSON object with two keys, in this order:\n"
+        f"- 'title': {TITLE_FORMAT}\n"
+        "- 'scenes': an array of the scenes described above"
+    )
 
-def generate_script(prompt_config: dict) -> tuple[list[dict], str]:
+# Helper function to generate a single prompt for several users: the shared format is only written once
+def build_batch_prompt(requests: dict[str, str]) -> str:
+    requests_str = "\n\n".join(f"Request {key}: {request}" for key, request in requests.items())
+    return (
+        "Answer each of the following independent requests.\n\n"
+        f"{requests_str}\n\n"
+        + SCENE_FORMAT
+        + "Return a JSON array with one object per request, with three keys in this order:\n"
+        "- 'request': the number of the request\n"
+        f"- 'title': {TITLE_FORMAT}\n"
+        "- 'scenes': an array of the scenes described above"
+    )
 
-    prompt = build_prompt(
+# Helper function to build the prompt of a user with the most recent covered topics (and the titles rejected during this run)
+def build_user_prompt(prompt_config: dict, rejected_titles: list[str] | None = None, request_only: bool = False) -> str:
+    covered_topics = prompt_crud.get_recent_covered_topics(prompt_config["id"], PROMPT_RECENT_TOPICS)
+    return (build_request if request_only else build_prompt)(
         topic=prompt_config["topic"],
         scope=prompt_config["scope"],
-        covered_topics=prompt_config["covered_topics"],
+        covered_topics=(rejected_titles or []) + covered_topics,
         wpm=prompt_config["wpm"]
     )
 
-    # Generate script from Gemini
-    response = text_model.generate_content(prompt)
-    response_data = extract_json_from_gemini(response.text)
+# Function to find the covered topic a new title is a near duplicate of (None if the title is new).
+# Titles are compared normalized with their words sorted, so "Coffee Espresso" matches "espresso coffee"
+def find_similar_topic(title: str, covered_keys: list[str]) -> str | None:
+    key = " ".join(sorted(prompt_crud.normalize_topic(title).split()))
+    for covered_key in covered_keys:
+        sorted_key = " ".join(sorted(covered_key.split()))
+        if key == sorted_key or difflib.SequenceMatcher(None, key, sorted_key).ratio() >= TOPIC_SIMILARITY_THRESHOLD:
+            return covered_key
+    return None
+
+# Helper function to decide if a new title has to be rejected (a near duplicate is kept on the last attempt)
+def reject_duplicate_title(title: str, covered_keys: list[str], rejected_titles: list[str], attempt: int) -> bool:
+    similar = find_similar_topic(title, covered_keys)
+    if not similar:
+        return False
+    if attempt >= SCRIPT_MAX_TOPIC_ATTEMPTS:
+        print(f"[WARN] Keeping '{title}' even if it is close to the covered topic '{similar}' (no attempts left)")
+        return False
+    print(f"[WARN] Rejected '{title}', too close to the covered topic '{similar}'. Requesting another topic")
+    metrics.record_counts("script_generation", duplicate_titles=1)
+    rejected_titles.append(title)
+    return True
+
+# Helper function to parse a structured response (falls back to the markdown extraction), None if it isn't JSON
+def parse_script_response(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return extract_json_from_gemini(text)
+    except json.JSONDecodeError:
+        return None
+
+# Helper function to check that a response has the shape of a script, so its fields can be repaired one by one
+def has_script_shape(data) -> bool:
+    return (
+        isinstance(data, dict)
+        and isinstance(data.get("scenes"), list)
+        and len(data["scenes"]) > 0
+        and all(isinstance(scene, dict) for scene in data["scenes"])
+    )
+
+# Helper function to get the invalid fields of a scene
+def get_invalid_scene_fields(scene: dict) -> list[str]:
+    invalid = [
+        field for field in ("scene_id", "narration", "image_prompt")
+        if not isinstance(scene.get(field), str) or not scene[field].strip()
+    ]
+    duration = scene.get("duration")
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)) or duration <= 0:
+        invalid.append("duration")
+    return invalid
+
+# Function to validate a script locally, returns the paths of its invalid fields (e.g, title, scenes[2].narration)
+def get_invalid_fields(data: dict) -> list[str]:
+    invalid = [] if isinstance(data.get("title"), str) and data["title"].strip() else ["title"]
+    for i, scene in enumerate(data["scenes"]):
+        invalid += [f"scenes[{i}].{field}" for field in get_invalid_scene_fields(scene)]
+    return invalid
+
+# Helper function to read a duration written as a string (e.g, "4" or "4.5s"), None if it isn't a positive number
+def parse_duration(value) -> float | None:
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*s?\s*", value) if isinstance(value, str) else None
+    return float(match.group(1)) or None if match else None
+
+# Function to fix the fields that don't need the model (ids and durations), returns the fields still invalid
+def repair_locally(data: dict, invalid: list[str], wpm: int, counts: Counter) -> list[str]:
+    remaining = []
+    for path in invalid:
+        match = FIELD_PATH_PATTERN.fullmatch(path)
+        if not match:
+            remaining.append(path)
+            continue
+        index, field = int(match.group(1)), match.group(2)
+        scene = data["scenes"][index]
+
+        if field == "scene_id":
+            scene["scene_id"] = f"scene_{index + 1}"
+        elif field == "duration" and parse_duration(scene.get("duration")):
+            scene["duration"] = parse_duration(scene["duration"])
+        elif field == "duration" and isinstance(scene.get("narration"), str) and scene["narration"].strip():
+            # Same estimate the prompt asks for: the time the narration takes to read at the user's pace
+            scene["duration"] = max(1.0, round(len(scene["narration"].split()) * 60 / wpm, 1))
+        else:
+            remaining.append(path)
+            continue
+        counts["local_repairs"] += 1
+    return remaining
+
+# Function to re-prompt Gemini for the invalid fields only, the valid ones are kept as they are
+def reprompt_fields(data: dict, invalid: list[str], prompt: str) -> None:
+    repair_prompt = (
+        f"{prompt}\n\n"
+        f"A previous answer to this request has invalid or empty fields:\n{json.dumps(data, ensure_ascii=False)}\n"
+        f"Return only the corrected values of these fields: {', '.join(invalid)}"
+    )
+    response = text_model.generate_content(repair_prompt, generation_config=REPAIR_GENERATION_CONFIG)
+    fixes = parse_script_response(response.text)
+    if not isinstance(fixes, list):
+        return
+
+    for fix in fixes:
+        if not isinstance(fix, dict) or fix.get("field") not in invalid:
+            continue
+        match = FIELD_PATH_PATTERN.fullmatch(fix["field"])
+        if match:
+            data["scenes"][int(match.group(1))][match.group(2)] = fix.get("value")
+        else:
+            data[fix["field"]] = fix.get("value")
+
+# Function to complete a script whose stream ended early (token limit, dropped stream): the scenes received are kept
+# as they are (some may already be in production) and Gemini is asked for the scenes after them only.
+# Returns False if no scene could be added
+def complete_truncated_script(data: dict, prompt: str) -> bool:
+    continuation_prompt = (
+        f"{prompt}\n\n"
+        f"A previous answer to this request was cut off after these scenes:\n{json.dumps(data, ensure_ascii=False)}\n"
+        f"Keep them as they are and return only the scenes that come after scene {len(data['scenes'])}, "
+        "as a JSON array of scenes (5–6 scenes in total)"
+    )
+    response = text_model.generate_content(continuation_prompt, generation_config=CONTINUATION_GENERATION_CONFIG)
+    scenes = parse_script_response(response.text)
+    if not isinstance(scenes, list) or not scenes:
+        return False
+    data["scenes"].extend(scene if isinstance(scene, dict) else {} for scene in scenes)
+    return True
+
+# Function to make sure a parsed response is a valid script: fields are repaired locally or re-prompted on their own,
+# and only a response without the shape of a script is requested again as a whole. The counts are persisted
+# in output/metrics/script_generation.json to follow how often the responses need repairs
+def ensure_valid_script(data, prompt: str, wpm: int) -> dict:
+    counts = Counter(scripts=1)
+    try:
+        for attempt in range(SCRIPT_MAX_REPAIRS + 1):
+            last_attempt = attempt == SCRIPT_MAX_REPAIRS
+
+            if not has_script_shape(data):
+                counts["parse_failures"] += 1
+                if last_attempt:
+                    break
+                print("[WARN] Gemini response is not a script, requesting it again")
+                counts["full_reprompts"] += 1
+                data = parse_script_response(text_model.generate_content(prompt, generation_config=SCRIPT_GENERATION_CONFIG).text)
+                continue
+
+            invalid = get_invalid_fields(data)
+            counts["invalid_fields"] += len(invalid)
+            invalid = repair_locally(data, invalid, wpm, counts)
+            if not invalid:
+                return data
+            if last_attempt:
+                break
+            print(f"[WARN] Invalid script fields, re-prompting for: {', '.join(invalid)}")
+            counts["field_reprompts"] += 1
+            reprompt_fields(data, invalid, prompt)
+
+        counts["failures"] += 1
+        raise ValueError(f"❌ Gemini returned an invalid script after {SCRIPT_MAX_REPAIRS} repair(s)")
+    finally:
+        metrics.record_counts("script_generation", **counts)
+
+# Function to parse a streamed response incrementally. Yields ("title", title) once the title is complete
+# and ("scene", scene) for every scene object as soon as its closing brace has arrived
+def iter_stream_events(chunks: Iterable[str]) -> Iterator[tuple[str, object]]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    title = None
+    # Position in the buffer of the next scene to parse (None until the scenes array has started)
+    position = None
+
+    for chunk in chunks:
+        buffer += chunk
+        if title is None:
+            match = TITLE_PATTERN.search(buffer)
+            if match:
+                title = json.loads(f'"{match.group(1)}"')
+                yield "title", title
+
+        if position is None:
+            match = SCENES_PATTERN.search(buffer)
+            if not match:
+                continue
+            position = match.end()
+
+        while True:
+            # Skip the separators between scenes
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer) or buffer[position] == "]":
+                break
+            try:
+                scene, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break # The scene is still being written
+            yield "scene", scene
+
+# Function to stream the script from Gemini, yielding (title, index, scene) for every valid scene as soon as it is complete.
+# Invalid scenes are handed over once repaired, and the script is saved (and the covered topics updated) at the end
+def stream_script(prompt_config: dict) -> Iterator[tuple[str, int, dict]]:
+    covered_keys = prompt_crud.get_covered_topic_keys(prompt_config["id"])
+    rejected_titles = []
+
+    for attempt in range(1, SCRIPT_MAX_TOPIC_ATTEMPTS + 1):
+        prompt = build_user_prompt(prompt_config, rejected_titles)
+        response = text_model.generate_content(prompt, generation_config=STREAM_GENERATION_CONFIG, stream=True)
+        # Full text kept aside in case the response has to be parsed as a whole
+        chunks = []
+        def iter_chunks():
+            for chunk in response:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+        title = None
+        scenes = []
+        # Scenes already handed over (the ones before the title can only go once the output dir is known)
+        handed_over = set()
+        duplicate = False
+        # Set if some scenes arrived before the title
+        late_title = False
+        for kind, value in iter_stream_events(iter_chunks()):
+            if kind == "title":
+                late_title = bool(scenes)
+                if isinstance(value, str) and value.strip():
+                    # The title comes first, so a duplicate topic is dropped before any scene is handed over
+                    duplicate = reject_duplicate_title(value, covered_keys, rejected_titles, attempt)
+                    if duplicate:
+                        break
+                    title = value
+            elif isinstance(value, dict):
+                scenes.append(value)
+            else:
+                scenes.append({}) # Not a scene, left to the repair
+
+            if title is None:
+                continue
+            for index, scene in enumerate(scenes):
+                if index not in handed_over and not get_invalid_scene_fields(scene):
+                    handed_over.add(index)
+                    yield title, index, scene
+        if duplicate:
+            continue
+        if scenes and (title is None or late_title):
+            # The scenes were written before the title, so nothing could start early
+            print("[WARN] The streamed script didn't start with its title, the scenes were handed over at the end")
+            metrics.record_counts("script_generation", scenes_before_title=1)
+
+        # The scenes parsed while streaming are only the whole script if the full response is complete JSON
+        complete = isinstance(parse_script_response("".join(chunks)), dict)
+        if title is not None and scenes:
+            response_data = {"title": title, "scenes": scenes}
+            if not complete:
+                print(f"[WARN] The streamed script was cut off after {len(scenes)} scene(s), requesting the rest")
+                metrics.record_counts("script_generation", truncated_streams=1)
+                if not complete_truncated_script(response_data, prompt):
+                    if handed_over:
+                        raise ValueError("❌ The streamed script was cut off and its remaining scenes could not be requested")
+                    # Nothing started yet, the script is requested again as a whole
+                    response_data = None
+        else:
+            # The response didn't have the expected shape while streaming (nothing was handed over yet),
+            # fallback to parsing it as a whole
+            response_data = parse_script_response("".join(chunks))
+
+        # Only the invalid fields are repaired, so the scenes already handed over don't change
+        response_data = ensure_valid_script(response_data, prompt, prompt_config["wpm"])
+        # Only a title that wasn't checked while streaming
+        if response_data["title"] != title and reject_duplicate_title(response_data["title"], covered_keys, rejected_titles, attempt):
+            continue
 
+        title, scenes = response_data["title"], response_data["scenes"]
+        for index, scene in enumerate(scenes):
+            if index not in handed_over:
+                yield title, index, scene
+
+        save_script(prompt_config, scenes, title)
+        return
+
+# Function to generate the script in streaming mode, calling on_scene(title, index, scene) for every scene as it arrives
+def generate_script_streaming(prompt_config: dict, on_scene) -> tuple[list[dict], str]:
+    scenes_by_index = {}
+    title = None
+    for title, index, scene in stream_script(prompt_config):
+        on_scene(title, index, scene)
+        scenes_by_index[index] = scene
+    scenes = [scenes_by_index[index] for index in sorted(scenes_by_index)]
+    print(f"✅ Script streamed: {len(scenes)} scenes")
+    return scenes, title
+
+# Function to save a generated script and add its title to the covered topics
+def save_script(prompt_config: dict, scenes: list[dict], title: str) -> None:
     # Updates the covered topics
-    new_title = response_data["title"]
-    prompt_crud.append_covered_topic_if_missing(prompt_config["id"], new_title)
+    prompt_crud.add_covered_topic(prompt_config["id"], title)
 
     # Writes the script to the output folder for the current topic
-    output_dir = get_output_dir(prompt_config["id"], new_title)
+    output_dir = get_output_dir(prompt_config["id"], title)
 
     script_path = os.path.join(output_dir, "script.json")
     with open(script_path, "w") as f:
-        json.dump(response_data["scenes"],f,indent=2)
+        json.dump(scenes,f,indent=2)
+
+
+# Function to generate the scripts of several users in a single request. Each script is validated on its own and
+# only the valid ones are saved and returned (by prompt config id), the others are left to a single user request
+def generate_scripts_batch(prompt_configs: list[dict]) -> list[tuple[list[dict], str] | None]:
+    configs_by_key = {str(i + 1): prompt_config for i, prompt_config in enumerate(prompt_configs)}
+    requests = {key: build_user_prompt(prompt_config, request_only=True) for key, prompt_config in configs_by_key.items()}
+    counts = Counter(batches=1, batched_users=len(configs_by_key))
+
+    try:
+        response = text_model.generate_content(build_batch_prompt(requests), generation_config=BATCH_GENERATION_CONFIG)
+        items = parse_script_response(response.text)
+    except Exception as e:
+        print(f"[WARN] Batched script request failed, every user falls back to its own request: {e}")
+        items = None
+    if not isinstance(items, list):
+        counts["parse_failures"] += 1
+        items = []
+    items_by_key = {str(item.get("request")): item for item in items if isinstance(item, dict)}
+
+    # One entry per request, in the order of prompt_configs (None for the ones left to their own request)
+    scripts = []
+    for key, prompt_config in configs_by_key.items():
+        scripts.append(None)
+        item = items_by_key.get(key) or {}
+        data = {"title": item.get("title"), "scenes": item.get("scenes")}
+        if not has_script_shape(data) or repair_locally(data, get_invalid_fields(data), prompt_config["wpm"], counts):
+            counts["batch_fallbacks"] += 1
+            continue
+        # A near duplicate is left to the single user request, which retries with the title rejected.
+        # The covered topics are read again for every request so the titles accepted earlier in the batch count too
+        if find_similar_topic(data["title"], prompt_crud.get_covered_topic_keys(prompt_config["id"])):
+            counts["batch_fallbacks"] += 1
+            continue
+
+        save_script(prompt_config, data["scenes"], data["title"])
+        scripts[-1] = (data["scenes"], data["title"])
+
+    metrics.record_counts("script_generation", **counts)
+    return scripts
+
+
+def generate_script(prompt_config: dict) -> tuple[list[dict], str]:
+    covered_keys = prompt_crud.get_covered_topic_keys(prompt_config["id"])
+    rejected_titles = []
+
+    for attempt in range(1, SCRIPT_MAX_TOPIC_ATTEMPTS + 1):
+        prompt = build_user_prompt(prompt_config, rejected_titles)
+
+        # Generate script from Gemini, constrained to the script schema
+        response = text_model.generate_content(prompt, generation_config=SCRIPT_GENERATION_CONFIG)
+        response_data = ensure_valid_script(parse_script_response(response.text), prompt, prompt_config["wpm"])
+        if not reject_duplicate_title(response_data["title"], covered_keys, rejected_titles, attempt):
+            break
+
+    new_title = response_data["title"]
+    save_script(prompt_config, response_data["scenes"], new_title)
 
-    return response_data["scenes"], new_title
\ No newline at end of file
+    return response_data["scenes"], new_title
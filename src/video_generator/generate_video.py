@@ -1,26 +1,350 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from src.crud import user_crud, prompt_crud
 from src.video_generator import generate_script, generate_audio, generate_images, stitch_video
 from src.poster import social_media_poster
+from src.utils import checkpoint, frame_store
+from src.utils.paths import get_output_dir
 
+# Stages each stage depends on, re-running one of them invalidates the checkpoint of the stages after it
+STAGE_UPSTREAM = {
+    "script": [],
+    "audio": ["script"],
+    "images": ["script"],
+    "stitch": ["script", "audio", "images"],
+    "post": ["stitch"],
+}
+
+
+# Helper function to run a pipeline stage and record how long it took
+# (on_stage, if given, is called as on_stage(stage, status, seconds, result_or_error) when the stage starts and ends)
+def run_stage(timings: dict, stage: str, fn, *args, on_stage=None):
+    if on_stage:
+        on_stage(stage, "running", None, None)
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        timings[stage] = time.perf_counter() - start
+        if on_stage:
+            on_stage(stage, "failed", timings[stage], e)
+        raise
+    timings[stage] = time.perf_counter() - start
+    if on_stage:
+        on_stage(stage, "done", timings[stage], result)
+    return result
+
+# Helper function to run a stage, or reuse its checkpointed result when resuming a run (manifest is None outside of resume mode)
+# files_fn maps the stage result to the files whose content hashes validate the checkpoint
+def run_checkpointed_stage(manifest: dict | None, timings: dict, stage: str, files_fn, fn, *args, on_stage=None, record=True):
+    upstream = STAGE_UPSTREAM[stage]
+    if manifest is not None:
+        reusable, result = checkpoint.get_valid_result(manifest, stage, upstream)
+        if reusable:
+            print(f"♻️ Reusing the {stage} stage of run {manifest['run_id']}")
+            timings[stage] = 0.0
+            if on_stage:
+                on_stage(stage, "reused", 0.0, result)
+            return result
+
+    result = run_stage(timings, stage, fn, *args, on_stage=on_stage)
+    if manifest is not None:
+        if record:
+            checkpoint.record_stage(manifest, stage, result, files_fn(result), upstream)
+        else:
+            # Recorded later by the caller, drop the stale entry so the stages after it don't match it meanwhile
+            manifest["stages"].pop(stage, None)
+    return result
+
+# Helper function to print the per stage timings and the critical path of the pipeline
+def print_timings(timings: dict, wall_seconds: float) -> None:
+    # Audio and images run in parallel so only the slowest of them is on the critical path
+    media_stage = max(("audio", "images"), key=lambda s: timings.get(s, 0))
+    critical_path = [stage for stage in ["script", media_stage, "stitch", "post"] if stage in timings]
+    critical_seconds = sum(timings.get(stage, 0) for stage in critical_path)
+
+    print("⏱️ Pipeline timings:")
+    for stage, seconds in timings.items():
+        marker = "*" if stage in critical_path else " "
+        print(f"  {marker} {stage:<8} {seconds:7.2f}s")
+    print(f"  critical path ({' -> '.join(critical_path)}): {critical_seconds:.2f}s, wall time: {wall_seconds:.2f}s")
+
+
+# Helper function to build the files_fn of the script stage
+def get_script_files(prompt_config: dict):
+    return lambda result: [os.path.join(get_output_dir(prompt_config['id'], result[1]), "script.json")]
+
+# Function to generate the audio and images of a complete script
+def build_media(
+    manifest: dict | None,
+    timings: dict,
+    script: list[dict],
+    title: str,
+    prompt_config: dict,
+    voice_id: str,
+    in_memory: bool,
+    on_stage=None
+) -> tuple[str, list[str]]:
+    # Audio and images only depend on the script, so they are generated in parallel
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="autoshorts-media") as executor:
+        # Generate audio using the narration from the script
+        audio_future = executor.submit(
+            run_checkpointed_stage, manifest, timings, "audio", lambda result: [result], generate_audio.generate_audio, script, voice_id, title, prompt_config['id'],
+            on_stage=on_stage
+        )
+        # Generate images for each scene in the script
+        images_future = executor.submit(
+            run_checkpointed_stage, manifest, timings, "images", list, generate_images.generate_images, script, title, prompt_config['id'],
+            on_stage=on_stage, record=not in_memory
+        )
+        return audio_future.result(), images_future.result()
+
+# Function to stream the script and start the image and narration clip of every scene as soon as it arrives
+# (SCRIPT_STREAMING). The audio and images timings only count what is left once the script is complete
+def build_media_streaming(
+    manifest: dict | None,
+    timings: dict,
+    prompt_config: dict,
+    voice_id: str,
+    in_memory: bool,
+    on_stage=None
+) -> tuple[list[dict], str, str, list[str]]:
+    image_workers = 1 if generate_images.USE_LOCAL_IMG_MODEL else generate_images.STABILITY_MAX_IN_FLIGHT
+    image_executor = ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="autoshorts-stream-image")
+    tts_executor = ThreadPoolExecutor(max_workers=generate_audio.TTS_MAX_IN_FLIGHT, thread_name_prefix="autoshorts-stream-tts")
+    image_futures, clip_futures = [], []
+
+    def dispatch_scene(title: str, index: int, scene: dict) -> None:
+        image_futures.append(image_executor.submit(generate_images.generate_scene_image, scene, index, title, prompt_config['id']))
+        clip_path = generate_audio.get_scene_clip_path(get_output_dir(prompt_config['id'], title), index)
+        clip_futures.append(tts_executor.submit(generate_audio.synthesize_scene_clip, scene["narration"], voice_id, clip_path))
+
+    with image_executor, tts_executor:
+        script, title = run_checkpointed_stage(
+            manifest, timings, "script", get_script_files(prompt_config),
+            generate_script.generate_script_streaming, prompt_config, dispatch_scene,
+            on_stage=on_stage
+        )
+
+        if not image_futures:
+            # The script was reused from the checkpoint, nothing was started while streaming
+            return script, title, *build_media(manifest, timings, script, title, prompt_config, voice_id, in_memory, on_stage)
+
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="autoshorts-media") as executor:
+            audio_future = executor.submit(
+                run_stage, timings, "audio",
+                lambda: generate_audio.join_streamed_clips([future.result() for future in clip_futures], title, prompt_config['id']),
+                on_stage=on_stage
+            )
+            images_future = executor.submit(
+                run_stage, timings, "images", lambda: [future.result() for future in image_futures],
+                on_stage=on_stage
+            )
+            audio_path = audio_future.result()
+            image_paths = images_future.result()
+
+    if manifest is not None:
+        checkpoint.record_stage(manifest, "audio", audio_path, [audio_path], STAGE_UPSTREAM["audio"])
+        if in_memory:
+            manifest["stages"].pop("images", None)
+        else:
+            checkpoint.record_stage(manifest, "images", image_paths, image_paths, STAGE_UPSTREAM["images"])
+    return script, title, audio_path, image_paths
+
+
+# Function to generate the scripts of the users due in a slot with batched requests (SCRIPT_BATCHING), before the
+# per user pipelines start. Each script is checkpointed in the user's run so build_video reuses it, the users
+# without a valid batched script generate their own as usual. jobs are (user_id, slot_at) pairs
+def prepare_batched_scripts(jobs: list[tuple]) -> None:
+    pending = []
+    batched_users = set()
+    for user_id, slot_at in jobs:
+        # A user due in several slots (render ahead) is only batched once: requests sharing the same covered topics
+        # would come back with the same title, its other slots generate their own script afterwards
+        if user_id in batched_users:
+            continue
+        manifest = checkpoint.load_manifest(checkpoint.make_run_id(user_id, slot_at), user_id)
+        if checkpoint.get_valid_result(manifest, "script", STAGE_UPSTREAM["script"])[0]:
+            continue # Already generated by a previous attempt of the slot
+        prompt_config = prompt_crud.get_prompt_config(user_id)
+        if prompt_config:
+            pending.append((manifest, prompt_config))
+            batched_users.add(user_id)
+    if not pending:
+        return
+
+    # Similar topics end up in the same requests
+    pending.sort(key=lambda p: (p[1]["topic"], p[1]["scope"] or ""))
+    size = generate_script.SCRIPT_BATCH_MAX_USERS
+    groups = [pending[i:i + size] for i in range(0, len(pending), size)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="autoshorts-script-batch") as executor:
+        results = list(executor.map(lambda group: generate_script.generate_scripts_batch([pc for _, pc in group]), groups))
+
+    prepared = 0
+    for group, scripts in zip(groups, results):
+        # The scripts keep the order of the group (one per slot)
+        for (manifest, prompt_config), script in zip(group, scripts):
+            if script is None:
+                continue
+            scenes, title = script
+            script_path = os.path.join(get_output_dir(prompt_config["id"], title), "script.json")
+            checkpoint.record_stage(manifest, "script", [scenes, title], [script_path], STAGE_UPSTREAM["script"])
+            prepared += 1
+
+    print(
+        f"[INFO] Batched scripts: {prepared}/{len(pending)} user(s) in {len(groups)} request(s) "
+        f"({time.perf_counter() - start:.2f}s), the others generate their own"
+    )
+
+
+# Function to build the final video of a user (script, audio, images and stitch) without posting it
+def build_video(user_id: int, timings: dict | None = None, on_stage=None, run_id: str | None = None) -> dict:
+    timings = {} if timings is None else timings
+    # With a run id every completed stage is checkpointed and reused by later attempts of the same run
+    manifest = checkpoint.load_manifest(run_id, user_id) if run_id else None
 
-def generate_video(user_id: int) -> str:
     # Load user data and prompt config from DB
     user = user_crud.get_user(user_id)
     prompt_config = prompt_crud.get_prompt_config(user_id)
 
-    # Generate the script
-    script, title = generate_script.generate_script(prompt_config)
+    # With the in-memory handoff the image files are only written in the background,
+    # so their checkpoint (and the stitch one that depends on it) is recorded once they are on disk
+    in_memory = generate_images.USE_LOCAL_IMG_MODEL and generate_images.IN_MEMORY_FRAMES
+    if in_memory and not generate_images.IN_MEMORY_ARCHIVE and stitch_video.RENDER_BACKEND != "moviepy":
+        raise ValueError("IN_MEMORY_ARCHIVE=0 requires RENDER_BACKEND=moviepy (the ffmpeg backends read the image files)")
+
+    if generate_script.SCRIPT_STREAMING:
+        script, title, audio_path, image_paths = build_media_streaming(
+            manifest, timings, prompt_config, user['voice_id'], in_memory, on_stage
+        )
+    else:
+        # Generate the script
+        script, title = run_checkpointed_stage(
+            manifest, timings, "script", get_script_files(prompt_config),
+            generate_script.generate_script, prompt_config,
+            on_stage=on_stage
+        )
+        audio_path, image_paths = build_media(manifest, timings, script, title, prompt_config, user['voice_id'], in_memory, on_stage)
+
+    # The ffmpeg backends read the images from disk
+    if in_memory and stitch_video.RENDER_BACKEND != "moviepy":
+        generate_images.wait_for_archive(image_paths)
+
+    try:
+        # Stitch the images and audio into the final video
+        final_video_path = run_checkpointed_stage(
+            manifest, timings, "stitch", lambda result: [result], stitch_video.stitch_video, script, image_paths, audio_path, title, prompt_config['id'],
+            prompt_config.get('encoder_profile'),
+            on_stage=on_stage, record=not in_memory
+        )
+
+        if in_memory and manifest is not None:
+            archived_paths = generate_images.wait_for_archive(image_paths)
+            if archived_paths:
+                checkpoint.record_stage(manifest, "images", image_paths, archived_paths, STAGE_UPSTREAM["images"])
+                checkpoint.record_stage(manifest, "stitch", final_video_path, [final_video_path], STAGE_UPSTREAM["stitch"])
+    finally:
+        # Even if the stitch failed, so long-lived workers don't keep the frames (or the archive futures nobody waits on)
+        frame_store.release_frames(image_paths)
+        generate_images.discard_archive(image_paths)
+
+    return {
+        "video_path": final_video_path,
+        "title": title,
+        # Use the first narration from the script as the description for the post
+        "description": script[0]['narration'] if script and 'narration' in script[0] else title,
+        "run_id": run_id,
+    }
+
+# Function to post an already built video to the social media platforms, returns the result of every platform.
+# The results are checkpointed (and written to post_results.json next to the video), so resuming a run only
+# posts again on the platforms that failed. In a retryable run (with a run id) a failed platform fails the stage
+# so the run can be retried, otherwise (e.g, the CLI) the failures are only reported in the results.
+# A timed out platform may still post in the background, so it is never posted again automatically: its real
+# result replaces the timeout in the checkpoint and post_results.json once it ends (a timeout left there needs a manual check)
+def post_built_video(user_id: int, video: dict, timings: dict | None = None, on_stage=None) -> dict[str, dict]:
+    timings = {} if timings is None else timings
+    manifest = checkpoint.load_manifest(video["run_id"], user_id) if video.get("run_id") else None
+
+    done = {}
+    if manifest is not None:
+        reusable, previous = checkpoint.get_valid_result(manifest, "post", STAGE_UPSTREAM["post"])
+        if reusable and isinstance(previous, dict):
+            done = {
+                platform: result for platform, result in previous.items()
+                if result["status"] in ("posted", "skipped", "timeout")
+            }
+        elif reusable:
+            # Posted before the per platform results were recorded
+            print(f"♻️ Reusing the post stage of run {manifest['run_id']}")
+            return {}
+    platforms = [platform for platform in social_media_poster.PLATFORM_POSTERS if platform not in done]
+    if not platforms:
+        print(f"♻️ Reusing the post stage of run {manifest['run_id']}")
+        timings["post"] = 0.0
+        if on_stage:
+            on_stage("post", "reused", 0.0, done)
+        return done
+    if done:
+        print(f"[INFO] Already posted on {', '.join(done)}, posting on {', '.join(platforms)}")
+
+    results = dict(done)
+    # Guards the results against the late results of the timed out platforms
+    results_lock = threading.Lock()
+
+    def save_results() -> None:
+        with open(os.path.join(os.path.dirname(video["video_path"]), "post_results.json"), "w") as f:
+            json.dump(results, f, indent=2)
+        if manifest is not None:
+            checkpoint.record_stage(manifest, "post", dict(results), [], STAGE_UPSTREAM["post"])
+
+    def record_late_result(platform: str, result: dict) -> None:
+        with results_lock:
+            results[platform] = result
+            save_results()
+        print(f"[INFO] {platform} finished after its timeout: {result['status']}")
+
+    def post_pending_platforms() -> dict[str, dict]:
+        posted = social_media_poster.post_video(
+            user_id, video["video_path"], video["description"], video["title"], platforms, on_late_result=record_late_result
+        )
+        with results_lock:
+            for platform, result in posted.items():
+                # A late result may already be recorded if the poster ended right after its timeout
+                results.setdefault(platform, result)
+            save_results()
+            snapshot = dict(results)
+
+        timed_out = [platform for platform, result in snapshot.items() if result["status"] == "timeout"]
+        if timed_out:
+            print(f"[WARN] No result yet on {', '.join(timed_out)}, not posting there again (check the account if it never finishes)")
+        failed = [platform for platform, result in snapshot.items() if result["status"] == "failed"]
+        if failed:
+            error = f"Posting failed on {', '.join(failed)}: " + "; ".join(snapshot[p]["error"] for p in failed)
+            if manifest is not None:
+                raise Exception(error)
+            print(f"[WARN] {error}")
+        return snapshot
+
+    return run_stage(timings, "post", post_pending_platforms, on_stage=on_stage)
 
-    # Generate audio using the narration from the script
-    audio_path = generate_audio.generate_audio(script, user['voice_id'], title, prompt_config['id'])
 
-    # Generate images for each scene in the script
-    image_paths = generate_images.generate_images(script, title, prompt_config['id'])
+# (post_results, if given, is filled with the result of every platform)
+def generate_video(user_id: int, on_stage=None, run_id: str | None = None, post_results: dict | None = None) -> str:
+    start = time.perf_counter()
+    timings = {}
 
-    # Stitch the images and audio into the final video
-    final_video_path = stitch_video.stitch_video(script,image_paths, audio_path, title, prompt_config['id'])
+    video = build_video(user_id, timings, on_stage, run_id)
 
-    # Post video to social media platforms (use the first narration from the script as the descriptionfor the post)
-    social_media_poster.post_video(user_id, final_video_path, script[0]['narration'] if script and 'narration' in script[0] else title, title)
+    # Post video to social media platforms
+    results = post_built_video(user_id, video, timings, on_stage)
+    if post_results is not None:
+        post_results.update(results)
 
-    return final_video_path
\ No newline at end of file
+    print_timings(timings, time.perf_counter() - start)
+    return video["video_path"]
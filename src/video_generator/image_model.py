@@ -0,0 +1,296 @@
+import os
+import time
+import functools
+import threading
+from contextlib import contextmanager
+import torch
+try:
+    import psutil # RSS sampling of the CPU generations
+except ImportError:
+    psutil = None
+from PIL import Image
+from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+from src.video_generator.generate_images import (
+    LOCAL_IMG_MODEL_ID, LOCAL_IMG_HEIGHT, LOCAL_IMG_WIDTH, LOCAL_IMG_PROFILE, LOCAL_IMG_STEPS
+)
+
+# Number of scenes per pipeline call, "auto" derives it from the available memory
+LOCAL_IMG_BATCH_SIZE = os.environ.get("LOCAL_IMG_BATCH_SIZE", "auto")
+# Rough memory needed per image in a batch at 640x1136 (fp16 activations + latents)
+LOCAL_IMG_BYTES_PER_IMAGE = 1.5 * 1024 ** 3
+# Memory budget of the local model in MB (weights + generation) on the device it runs on. When set, the low memory
+# mode slices the attention and the VAE decode, tiles or offloads what doesn't fit and caps the batch size
+LOCAL_IMG_MEMORY_BUDGET_MB = int(os.environ["LOCAL_IMG_MEMORY_BUDGET_MB"]) if os.environ.get("LOCAL_IMG_MEMORY_BUDGET_MB") else None
+# Number of torch threads used on CPU (defaults to every core)
+LOCAL_IMG_THREADS = int(os.environ.get("LOCAL_IMG_THREADS") or os.cpu_count() or 1)
+# Seconds between two RSS samples while a CPU generation runs
+MEMORY_SAMPLE_SECONDS = 0.05
+
+# Local inference profiles:
+# - dtype: weights and activations precision (float16 is only fast on GPU, CPUs want float32 or bfloat16)
+# - scheduler: "dpm" swaps the default PNDM scheduler for DPM-Solver++ which converges in far fewer steps
+# - steps: number of denoising steps (the UNet runs once per step, so this is most of the CPU time)
+# - export: "onnx" or "openvino" runs an exported graph through optimum instead of torch (optional extra install)
+# - warmup: run a throwaway 1 step generation at load so the first real scene doesn't pay for the graph setup
+LOCAL_IMG_PROFILES = {
+    "gpu": {"device": "cuda", "dtype": "float16", "scheduler": None, "steps": 50, "export": None, "warmup": False},
+    # Same quality as the GPU profile in less than half the steps
+    "cpu-quality": {"device": "cpu", "dtype": "float32", "scheduler": "dpm", "steps": 25, "export": None, "warmup": True},
+    # Drafts on render nodes without a GPU (bfloat16 needs a CPU with AVX512-BF16/AMX to be faster)
+    "cpu-fast": {"device": "cpu", "dtype": "bfloat16", "scheduler": "dpm", "steps": 15, "export": None, "warmup": True},
+    # Needs `pip install optimum[onnxruntime]`
+    "cpu-onnx": {"device": "cpu", "dtype": "float32", "scheduler": "dpm", "steps": 20, "export": "onnx", "warmup": True},
+    # Needs `pip install optimum[openvino]`, usually the fastest on Intel CPUs
+    "cpu-openvino": {"device": "cpu", "dtype": "float32", "scheduler": "dpm", "steps": 20, "export": "openvino", "warmup": True},
+}
+
+# The pipeline is loaded on first use and kept for the lifetime of the process (with the profile it was loaded with)
+pipe = None
+pipe_profile = None
+# Bytes of model weights resident on the device (0 when offloaded to the CPU)
+pipe_weights_bytes = 0
+# Guards the lazy load and serializes generations since the pipeline is not thread safe
+pipe_lock = threading.Lock()
+
+
+# Helper function to resolve the inference profile of the local model (with the steps override applied)
+def get_local_profile(name: str | None = None) -> tuple[str, dict]:
+    name = name or LOCAL_IMG_PROFILE
+    if name == "auto":
+        name = "gpu" if torch.cuda.is_available() else "cpu-quality"
+    if name not in LOCAL_IMG_PROFILES:
+        print(f"[WARN] Unknown local image profile '{name}', using 'cpu-quality'")
+        name = "cpu-quality"
+    profile = dict(LOCAL_IMG_PROFILES[name])
+    if profile["device"] == "cuda" and not torch.cuda.is_available():
+        print("[WARN] No GPU available, running the gpu profile on CPU in float32")
+        profile.update(device="cpu", dtype="float32")
+    if LOCAL_IMG_STEPS:
+        profile["steps"] = LOCAL_IMG_STEPS
+    return name, profile
+
+# Helper function to describe everything in the resolved profile that changes the generated images (part of the image
+# cache keys, and reported by the image server). Cached since the profile only depends on the environment
+@functools.cache
+def get_profile_key() -> str:
+    name, profile = get_local_profile()
+    parts = [name, profile["device"], profile["dtype"], profile["scheduler"], profile["steps"], profile["export"]]
+    return ":".join(str(part) for part in parts)
+
+# Helper function to load the model exported to ONNX Runtime or OpenVINO (exported once into models/)
+def load_exported_pipeline(export: str):
+    try:
+        if export == "onnx":
+            from optimum.onnxruntime import ORTStableDiffusionPipeline as ExportedPipeline
+        else:
+            from optimum.intel import OVStableDiffusionPipeline as ExportedPipeline
+    except ImportError:
+        extra = "onnxruntime" if export == "onnx" else "openvino"
+        raise RuntimeError(f"The {export} profile needs optimum, install it with `pip install optimum[{extra}]`")
+
+    export_dir = os.path.join("models", export, LOCAL_IMG_MODEL_ID.replace("/", "--"))
+    if os.path.isdir(export_dir):
+        return ExportedPipeline.from_pretrained(export_dir)
+
+    print(f"🧠 Exporting {LOCAL_IMG_MODEL_ID} to {export} (only the first time)...")
+    exported = ExportedPipeline.from_pretrained(LOCAL_IMG_MODEL_ID, export=True, cache_dir="models/")
+    exported.save_pretrained(export_dir)
+    return exported
+
+# Helper function to get the size of the weights of a torch pipeline
+def get_weights_bytes(pipeline) -> int:
+    models = (pipeline.unet, pipeline.vae, pipeline.text_encoder)
+    return sum(p.numel() * p.element_size() for model in models for p in model.parameters())
+
+# Function to enable the memory savings a pipeline needs to stay within LOCAL_IMG_MEMORY_BUDGET_MB and move it to its device
+def apply_memory_budget(loaded, profile: dict):
+    global pipe_weights_bytes
+    budget = LOCAL_IMG_MEMORY_BUDGET_MB * 1024 ** 2
+    weights = get_weights_bytes(loaded)
+
+    # Always on in low memory mode: attention computed in slices and the batch decoded one image at a time
+    loaded.enable_attention_slicing()
+    loaded.enable_vae_slicing()
+    modes = ["attention slicing", "vae slicing"]
+
+    if budget < weights + 2 * LOCAL_IMG_BYTES_PER_IMAGE:
+        # Not even room for two images: decode each latent tile by tile (the VAE decode is the peak at 640x1136)
+        loaded.enable_vae_tiling()
+        modes.append("vae tiling")
+
+    if profile["device"] == "cuda" and budget < weights + LOCAL_IMG_BYTES_PER_IMAGE:
+        # The weights don't fit next to a single image: keep them in RAM and only move each submodule
+        # to the GPU while it runs (needs accelerate, much slower but uses a fraction of the VRAM)
+        loaded.enable_sequential_cpu_offload()
+        modes.append("sequential cpu offload")
+        pipe_weights_bytes = 0
+    else:
+        loaded = loaded.to(profile["device"])
+        pipe_weights_bytes = weights
+        if budget < weights + LOCAL_IMG_BYTES_PER_IMAGE:
+            print(f"[WARN] The {weights / 1024 ** 2:.0f} MB of weights leave no room for a generation in {LOCAL_IMG_MEMORY_BUDGET_MB} MB")
+
+    print(f"🧠 Low memory mode ({LOCAL_IMG_MEMORY_BUDGET_MB} MB budget): {', '.join(modes)}")
+    return loaded
+
+# Helper to measure the peak memory of a single generation, stored in the yielded dict as "peak_bytes" once it ends.
+# On GPU it is the peak of the allocations, on CPU the peak RSS growth over the RSS at the start of the generation,
+# sampled by a short-lived thread (None when psutil isn't installed)
+@contextmanager
+def track_peak_memory(device: str):
+    memory = {"peak_bytes": None}
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+        yield memory
+        memory["peak_bytes"] = torch.cuda.max_memory_allocated()
+        return
+    if psutil is None:
+        yield memory
+        return
+
+    process = psutil.Process()
+    start_rss = process.memory_info().rss
+    peak_rss = [start_rss]
+    stop = threading.Event()
+
+    def sample() -> None:
+        while not stop.wait(MEMORY_SAMPLE_SECONDS):
+            peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample, name="autoshorts-memory-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield memory
+    finally:
+        stop.set()
+        sampler.join()
+    memory["peak_bytes"] = max(peak_rss[0], process.memory_info().rss) - start_rss
+
+# Function to load a pipeline for the given profile
+def load_pipeline(profile: dict):
+    if profile["device"] == "cpu":
+        torch.set_num_threads(LOCAL_IMG_THREADS)
+
+    if profile["export"]:
+        loaded = load_exported_pipeline(profile["export"])
+        if LOCAL_IMG_MEMORY_BUDGET_MB:
+            print(f"[WARN] The {profile['export']} runtime manages its own memory, the budget only caps the batch size")
+    else:
+        # Load the model into a project local folder
+        # (Note: it will not install every run but only if it is not there or only corrupted sections)
+        loaded = StableDiffusionPipeline.from_pretrained(
+            LOCAL_IMG_MODEL_ID,
+            cache_dir="models/", # Set a local folder instaed of ~/.cache default
+            torch_dtype=getattr(torch, profile["dtype"])
+        )
+        if LOCAL_IMG_MEMORY_BUDGET_MB:
+            loaded = apply_memory_budget(loaded, profile)
+        else:
+            loaded = loaded.to(profile["device"])
+
+    if profile["scheduler"] == "dpm":
+        loaded.scheduler = DPMSolverMultistepScheduler.from_config(loaded.scheduler.config)
+
+    if profile["warmup"]:
+        start = time.perf_counter()
+        loaded("warmup", height=LOCAL_IMG_HEIGHT, width=LOCAL_IMG_WIDTH, num_inference_steps=1)
+        print(f"🧠 Warm-up done in {time.perf_counter() - start:.1f}s")
+    return loaded
+
+# Function to load the model once per process
+def get_pipeline():
+    global pipe, pipe_profile
+    with pipe_lock:
+        if pipe is None:
+            profile_name, profile = get_local_profile()
+            print(f"🧠 Loading {LOCAL_IMG_MODEL_ID} ({profile_name}: {profile['dtype']}, {profile['steps']} steps on {profile['device']})...")
+            pipe = load_pipeline(profile)
+            pipe_profile = profile
+    return pipe
+
+# Helper function to decide how many scenes go in a single local pipeline call
+def get_local_batch_size(num_scenes: int) -> int:
+    if LOCAL_IMG_BATCH_SIZE != "auto":
+        return max(1, min(int(LOCAL_IMG_BATCH_SIZE), num_scenes))
+
+    # Estimate from the free memory of the device the pipeline runs on
+    if torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info()
+    else:
+        try:
+            free_bytes = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            free_bytes = 0 # Not available on windows, fallback to one scene per call
+    if LOCAL_IMG_MEMORY_BUDGET_MB:
+        free_bytes = min(free_bytes, LOCAL_IMG_MEMORY_BUDGET_MB * 1024 ** 2 - pipe_weights_bytes)
+    return max(1, min(num_scenes, int(free_bytes // LOCAL_IMG_BYTES_PER_IMAGE)))
+
+# Function to generate an image per prompt using batched pipeline calls (a fixed seed makes the output reproducible)
+def generate_local_batch(prompts: list[str], seed: int | None = None) -> list[Image.Image]:
+    pipeline = get_pipeline()
+    profile = pipe_profile
+    images = []
+    batch_size = get_local_batch_size(len(prompts))
+    print(f"🧠 Local batch size: {batch_size}")
+
+    start = 0
+    while start < len(prompts):
+        batch = prompts[start:start + batch_size]
+        print(f"Generating images for Scenes {start + 1}-{start + len(batch)}")
+        try:
+            # A single call shares the text encoder, UNet loop and VAE decode across the whole batch
+            generator = None
+            # Exported pipelines don't take torch generators (their output is only reproducible with torch)
+            if seed is not None and not profile["export"]:
+                generator = [torch.Generator(device=profile["device"]).manual_seed(seed) for _ in batch]
+            with pipe_lock, track_peak_memory(profile["device"]) as memory:
+                images.extend(pipeline(
+                    batch, height=LOCAL_IMG_HEIGHT, width=LOCAL_IMG_WIDTH,
+                    num_inference_steps=profile["steps"], generator=generator
+                ).images)
+            peak_bytes = memory["peak_bytes"]
+        except torch.cuda.OutOfMemoryError:
+            if batch_size == 1:
+                raise
+            # The estimate was too optimistic, retry the same scenes with a smaller batch
+            torch.cuda.empty_cache()
+            batch_size = max(1, batch_size // 2)
+            print(f"[WARN] Out of memory, reducing local batch size to {batch_size}")
+            continue
+        start += len(batch)
+
+        if peak_bytes is not None:
+            budget = f" / {LOCAL_IMG_MEMORY_BUDGET_MB} MB budget" if LOCAL_IMG_MEMORY_BUDGET_MB else ""
+            scope = "GPU" if profile["device"] == "cuda" else "RSS growth during the generation"
+            print(f"📈 Peak memory ({scope}): {peak_bytes / 1024 ** 2:.0f} MB{budget}")
+
+    return images
+
+# Function to measure the seconds per image of each local profile at the local resolution (see `main.py --benchmark-images`)
+def benchmark_local_profiles(profile_names: list[str], num_images: int = 3) -> list[dict]:
+    prompt = "A lighthouse on a rocky coast at sunset, cinematic lighting, vertical composition"
+    results = []
+    for name in profile_names:
+        profile_name, profile = get_local_profile(name)
+        start = time.perf_counter()
+        try:
+            loaded = load_pipeline(profile)
+        except RuntimeError as e:
+            print(f"[WARN] Skipping {profile_name}: {e}")
+            continue
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(num_images):
+            loaded(prompt, height=LOCAL_IMG_HEIGHT, width=LOCAL_IMG_WIDTH, num_inference_steps=profile["steps"])
+        per_image = (time.perf_counter() - start) / num_images
+
+        results.append({"profile": profile_name, "steps": profile["steps"], "load_seconds": round(load_seconds, 1), "seconds_per_image": round(per_image, 1)})
+        print(f"⏱️ {profile_name}: {per_image:.1f}s/image at {LOCAL_IMG_WIDTH}x{LOCAL_IMG_HEIGHT} ({profile['steps']} steps, loaded in {load_seconds:.1f}s)")
+        del loaded
+
+    print("\n========== Local image benchmark ==========")
+    for r in results:
+        print(f" {r['profile']:<14} {r['steps']:>3} steps  {r['seconds_per_image']:>6.1f}s/image  (load {r['load_seconds']}s)")
+    print("===========================================\n")
+    return results
@@ -0,0 +1,77 @@
+import os
+import io
+import json
+import base64
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.video_generator import image_model
+
+# Address of the resident image model server (local only)
+IMAGE_SERVER_HOST = os.environ.get("IMAGE_SERVER_HOST", "127.0.0.1")
+IMAGE_SERVER_PORT = int(os.environ.get("IMAGE_SERVER_PORT", 8765))
+
+
+# Request handler exposing the warm pipeline over local HTTP
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    # Helper to send a JSON response
+    def send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Health check used by the client to know if the server is running
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        # The profile the server generates with is part of the clients' image cache keys
+        self.send_json(200, {"status": "ok", "model": image_model.LOCAL_IMG_MODEL_ID, "profile": image_model.get_profile_key()})
+
+    # Generation job: {"prompts": [...], "seed": int | null} -> {"images": [base64 png, ...]} in the same order
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+            prompts = job["prompts"]
+            seed = job.get("seed")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"invalid request: {e}"})
+            return
+
+        try:
+            images = image_model.generate_local_batch(prompts, seed)
+        except Exception as e:
+            print(f"[ERROR] Generation job failed: {e}")
+            self.send_json(500, {"error": str(e)})
+            return
+
+        # PNG keeps the frames lossless, the client does the resize and JPEG encode as before
+        encoded = []
+        for image in images:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            encoded.append(base64.b64encode(buffer.getvalue()).decode())
+        self.send_json(200, {"images": encoded})
+
+    # Keep the default per request logs short
+    def log_message(self, format, *args):
+        print(f"[INFO] {self.address_string()} {format % args}")
+
+# Function to start the daemon, loading the pipeline once and serving jobs until interrupted
+def run_image_server() -> None:
+    # Warm the pipeline before accepting jobs so the first request doesn't pay the load
+    image_model.get_pipeline()
+
+    server = ThreadingHTTPServer((IMAGE_SERVER_HOST, IMAGE_SERVER_PORT), ImageRequestHandler)
+    print(f"✅ Image model server listening on http://{IMAGE_SERVER_HOST}:{IMAGE_SERVER_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping image model server...")
+    finally:
+        server.server_close()
@@ -1,18 +1,178 @@
 from moviepy import ImageClip, AudioFileClip, concatenate_videoclips
 from moviepy.video.fx import Crop
+from concurrent.futures import ThreadPoolExecutor
 from src.utils.paths import get_output_dir
+from src.utils import ffmpeg, disk_cache, frame_store
+from src.utils.checkpoint import file_sha256
 import os
+import json
+import time
 
-def stitch_video(script: list[dict], image_paths: list[str], audio_path: str, title: str, prompt_config_id: int) -> str:
+# Render engine: "moviepy" composes every frame in python, "ffmpeg" renders the still images directly with ffmpeg,
+# "segments" encodes every scene as its own cached segment in parallel and joins them without re-encoding
+RENDER_BACKEND = os.environ.get("RENDER_BACKEND", "moviepy").lower()
+
+# Max number of scene segments encoded at the same time (one ffmpeg process each)
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS") or os.cpu_count() or 2)
+# Disk budget of the encoded segment cache
+SEGMENT_CACHE_MAX_MB = int(os.environ.get("SEGMENT_CACHE_MAX_MB", 2048))
+
+# Target size for Shorts (9:16)
+TARGET_WIDTH, TARGET_HEIGHT = 1080, 1920
+
+# Named libx264 encoder profiles, chosen per user (prompt_config.encoder_profile) or per run (ENCODER_PROFILE)
+# crf and bitrate are alternatives: a profile with a bitrate is encoded at that target instead of constant quality
+ENCODER_PROFILES = {
+    # Quick previews, bigger files
+    "fast-draft": {
+        "preset": "ultrafast", "crf": 30, "bitrate": None, "maxrate": None, "bufsize": None,
+        "tune": "stillimage", "fps": 24, "keyint": 48, "threads": 0,
+    },
+    # Close to the previous defaults (libx264 medium) tuned for still images
+    "balanced": {
+        "preset": "medium", "crf": 23, "bitrate": None, "maxrate": None, "bufsize": None,
+        "tune": "stillimage", "fps": 24, "keyint": 48, "threads": 0,
+    },
+    # Smallest files for faster uploads, capped bitrate and slower encode
+    "upload-optimized": {
+        "preset": "slow", "crf": 27, "bitrate": None, "maxrate": "2500k", "bufsize": "5000k",
+        "tune": "stillimage", "fps": 24, "keyint": 96, "threads": 0,
+    },
+}
+DEFAULT_ENCODER_PROFILE = "balanced"
+
+
+# Helper function to resolve the encoder profile of a render (a run override beats the user's choice)
+def get_encoder_profile(name: str | None = None) -> tuple[str, dict]:
+    name = os.environ.get("ENCODER_PROFILE") or name or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        print(f"[WARN] Unknown encoder profile '{name}', using '{DEFAULT_ENCODER_PROFILE}'")
+        name = DEFAULT_ENCODER_PROFILE
+    return name, ENCODER_PROFILES[name]
+
+# Helper function to build the libx264 rate control arguments of a profile (preset and threads are passed separately)
+def get_x264_params(profile: dict) -> list[str]:
+    params = ["-tune", profile["tune"], "-g", str(profile["keyint"])]
+    if profile["bitrate"]:
+        params += ["-b:v", profile["bitrate"]]
+    else:
+        params += ["-crf", str(profile["crf"])]
+    if profile["maxrate"]:
+        # Capped CRF: the bitrate can't go over the cap even on the hardest frames
+        params += ["-maxrate", profile["maxrate"], "-bufsize", profile["bufsize"]]
+    return params
+
+# Helper function to build the ffmpeg filter that fits an image to the Shorts frame
+# (same layout as the moviepy path: fit the height, then center crop or pad the width with black bars)
+def get_fit_filter(fps: int) -> str:
+    return (
+        f"scale=-2:{TARGET_HEIGHT},"
+        f"crop='min(iw,{TARGET_WIDTH})':{TARGET_HEIGHT},"
+        f"pad={TARGET_WIDTH}:{TARGET_HEIGHT}:(ow-iw)/2:0:black,"
+        f"setsar=1,fps={fps},format=yuv420p"
+    )
+
+# Function to render the slideshow with ffmpeg directly: each image is decoded and scaled once and
+# shown for its exact scene duration (concat demuxer), and the narration is muxed without any python side decode
+def render_with_ffmpeg(durations: list[float], image_paths: list[str], audio_path: str, final_video_path: str, profile: dict) -> str:
+    list_path = os.path.join(os.path.dirname(final_video_path), "slideshow.txt")
+    ffmpeg.write_concat_list(list_path, [os.path.abspath(p) for p in image_paths], durations)
+
+    ffmpeg.run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", audio_path,
+        "-map", "0:v", "-map", "1:a",
+        "-vf", get_fit_filter(profile["fps"]),
+        "-c:v", "libx264", "-preset", profile["preset"], "-threads", str(profile["threads"]),
+        *get_x264_params(profile),
+        "-c:a", "aac",
+        # The video length is the sum of the scene durations, like the moviepy path
+        "-t", f"{sum(durations):.3f}",
+        "-movflags", "+faststart",
+        final_video_path,
+    ])
+    return final_video_path
+
+# Function to encode (or reuse from the cache) the video-only segment of a single scene
+def encode_scene_segment(image_path: str, duration: float, profile: dict, threads: int, segment_path: str) -> str:
+    frames = max(1, round(duration * profile["fps"]))
+    # Everything that changes the encoded bytes (threads only change the speed)
+    cache_key = disk_cache.make_cache_key(
+        image_sha256=file_sha256(image_path),
+        frames=frames,
+        profile={k: v for k, v in profile.items() if k != "threads"},
+        filter=get_fit_filter(profile["fps"]),
+    )
+    cached_path = disk_cache.lookup("segments", cache_key, ".mp4")
+    if cached_path:
+        return disk_cache.link_or_copy(cached_path, segment_path)
+
+    ffmpeg.run_ffmpeg([
+        "-loop", "1", "-framerate", str(profile["fps"]), "-i", os.path.abspath(image_path),
+        "-vf", get_fit_filter(profile["fps"]),
+        "-frames:v", str(frames),
+        "-c:v", "libx264", "-preset", profile["preset"], "-threads", str(threads),
+        *get_x264_params(profile),
+        "-an",
+        disk_cache.unlink_destination(segment_path),
+    ])
+    disk_cache.store("segments", cache_key, ".mp4", segment_path, SEGMENT_CACHE_MAX_MB * 1024 * 1024)
+    return segment_path
+
+# Function to render the slideshow as one segment per scene: the segments are encoded in parallel
+# ffmpeg processes, cached by content, and joined with a stream copy (only the narration is encoded)
+def render_with_segments(durations: list[float], image_paths: list[str], audio_path: str, final_video_path: str, profile: dict) -> str:
+    segments_dir = os.path.join(os.path.dirname(final_video_path), "segments")
+    os.makedirs(segments_dir, exist_ok=True)
+
+    workers = max(1, min(SEGMENT_WORKERS, len(image_paths)))
+    # Split the cores between the parallel encodes instead of letting every ffmpeg use all of them
+    threads = profile["threads"] or max(1, (os.cpu_count() or 1) // workers)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="autoshorts-segment") as executor:
+        futures = [
+            executor.submit(
+                encode_scene_segment, image_path, durations[i], profile, threads,
+                os.path.join(segments_dir, f"scene_{i + 1}.mp4")
+            )
+            for i, image_path in enumerate(image_paths)
+        ]
+        segment_paths = [future.result() for future in futures]
+
+    stats = disk_cache.get_stats("segments")
+    print(f"🎞️ Scene segments: {stats['hits']} cache hits / {stats['misses']} misses this process")
+
+    list_path = os.path.join(segments_dir, "segments.txt")
+    ffmpeg.write_concat_list(list_path, segment_paths)
+    ffmpeg.run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", audio_path,
+        "-map", "0:v", "-map", "1:a",
+        "-c:v", "copy",
+        "-c:a", "aac",
+        "-t", f"{sum(durations):.3f}",
+        "-movflags", "+faststart",
+        final_video_path,
+    ])
+    return final_video_path
+
+# Function to render the slideshow by composing the clips with moviepy
+def render_with_moviepy(durations: list[float], image_paths: list[str], audio_path: str, final_video_path: str, profile: dict) -> str:
     audio_clip = AudioFileClip(audio_path)
     image_clips = []
 
-    # Target size for Shorts (9:16)
-    target_width, target_height = 1080, 1920
+    target_width, target_height = TARGET_WIDTH, TARGET_HEIGHT
 
     # Convert image paths to image clips
     for i, image_path in enumerate(image_paths):
-        duration = script[i].get("duration", 5)
+        duration = durations[i]
+
+        # Frames handed over in memory are already at the target size, no decode or resize needed
+        frame = frame_store.get_frame(image_path)
+        if frame is not None:
+            image_clips.append(ImageClip(frame, duration=duration).with_position("center"))
+            continue
+
         clip = ImageClip(image_path, duration=duration)
 
         # Resize height to target (1920 for Shorts)
@@ -43,9 +203,49 @@ def stitch_video(script: list[dict], image_paths: list[str], audio_path: str, ti
 
     # Stitch and export
     video = concatenate_videoclips(image_clips, method="compose").with_audio(audio_clip)
+    video.write_videofile(
+        final_video_path,
+        fps=profile["fps"],
+        codec="libx264",
+        audio_codec="aac",
+        preset=profile["preset"],
+        threads=profile["threads"] or None, # 0 lets ffmpeg pick
+        ffmpeg_params=get_x264_params(profile),
+    )
+    return final_video_path
+
+def stitch_video(
+    script: list[dict],
+    image_paths: list[str],
+    audio_path: str,
+    title: str,
+    prompt_config_id: int,
+    encoder_profile: str | None = None
+) -> str:
     output_dir = get_output_dir(prompt_config_id, title)
     final_video_path = os.path.join(output_dir, "final_video.mp4")
-    video.write_videofile(final_video_path, fps=24, codec="libx264", audio_codec="aac")
+    durations = [script[i].get("duration", 5) for i in range(len(image_paths))]
+    profile_name, profile = get_encoder_profile(encoder_profile)
+
+    start = time.perf_counter()
+    if RENDER_BACKEND == "ffmpeg":
+        render_with_ffmpeg(durations, image_paths, audio_path, final_video_path, profile)
+    elif RENDER_BACKEND == "segments":
+        render_with_segments(durations, image_paths, audio_path, final_video_path, profile)
+    else:
+        render_with_moviepy(durations, image_paths, audio_path, final_video_path, profile)
+    encode_seconds = time.perf_counter() - start
+
+    # Record how the video was encoded next to it, to compare profiles on real renders
+    render_info = {
+        "backend": RENDER_BACKEND,
+        "profile": profile_name,
+        "settings": profile,
+        "encode_seconds": round(encode_seconds, 2),
+        "size_bytes": os.path.getsize(final_video_path),
+    }
+    with open(os.path.join(output_dir, "render_info.json"), "w") as f:
+        json.dump(render_info, f, indent=2)
 
-    print(f"✅ Final video saved to {final_video_path}")
-    return final_video_path
\ No newline at end of file
+    print(f"✅ Final video saved to {final_video_path} ({profile_name}, {encode_seconds:.1f}s, {render_info['size_bytes'] / 1e6:.1f} MB)")
+    return final_video_path